@@ -0,0 +1,115 @@
+from __future__ import annotations
+from array import array
+from bisect import bisect_right
+from typing import Iterable, Iterator, List, Optional, Tuple
+import heapq
+
+from cyclicgentmx.helpers import lcm
+
+
+class TileAnimation:
+    """Frames of one animated gid as arrays of frame start offsets and frame gids"""
+    __slots__ = ('gid', 'offsets', 'gids', 'duration')
+
+    def __init__(self, gid: int, frames: Iterable[Tuple[int, int]]) -> None:
+        """frames are (frame gid, frame duration) pairs"""
+        self.gid = gid
+        self.offsets = array('q')
+        self.gids = array('q')
+        offset = 0
+        for frame_gid, duration in frames:
+            self.offsets.append(offset)
+            self.gids.append(frame_gid)
+            offset += duration
+        self.duration = offset
+
+    def gid_at(self, time: int) -> int:
+        return self.gids[bisect_right(self.offsets, time % self.duration) - 1]
+
+    def next_change(self, time: int) -> int:
+        """Time of first frame start after "time" """
+        cycle, offset = divmod(time, self.duration)
+        index = bisect_right(self.offsets, offset)
+        if index < len(self.offsets):
+            return cycle * self.duration + self.offsets[index]
+        return (cycle + 1) * self.duration
+
+
+class AnimationTimeline:
+    """Animations of gids without expansion of their common cycle.
+
+    Gid at some time is found by binary search in its frames, change events of all gids are merged lazily
+    by heap. With "quantum" event times are rounded down to its multiples, so events close in time give one frame.
+    """
+
+    def __init__(self, animations: Iterable[TileAnimation], quantum: Optional[int] = None) -> None:
+        self.animations = [animation for animation in animations if animation.duration > 0]
+        self.quantum = quantum if quantum and quantum > 1 else None
+        self.period = lcm([animation.duration for animation in self.animations]) if self.animations else 0
+
+    @classmethod
+    def from_tilesets(cls, tilesets: list, gids: Optional[set] = None, quantum: Optional[int] = None
+                      ) -> AnimationTimeline:
+        """Timeline of animated tiles of tilesets, only of "gids" if they are given"""
+        animations = []
+        for tileset in tilesets:
+            for tile in tileset.tiles:
+                if tile.animation:
+                    gid = tile.id + tileset.firstgid
+                    if gids is None or gid in gids:
+                        frames = ((frame.tileid + tileset.firstgid, frame.duration)
+                                  for frame in tile.animation.childs)
+                        animations.append(TileAnimation(gid, frames))
+        return cls(animations, quantum)
+
+    @property
+    def gids(self) -> set:
+        return {animation.gid for animation in self.animations}
+
+    def _round(self, time: int) -> int:
+        return time - time % self.quantum if self.quantum else time
+
+    def state_at(self, time: int) -> dict:
+        """Gid shown at "time" for every animated gid"""
+        return {animation.gid: animation.gid_at(time) for animation in self.animations}
+
+    def events(self) -> Iterator[Tuple[int, dict]]:
+        """(time, {gid: new gid}) of every time in cycle after 0 when some gid changes, in time order"""
+        heap = [(animation.next_change(0), index) for index, animation in enumerate(self.animations)]
+        heapq.heapify(heap)
+        state = self.state_at(0)
+        while heap:
+            time = self._round(heap[0][0])
+            if time >= self.period:
+                return
+            changes = dict()
+            while heap and self._round(heap[0][0]) == time:
+                change_time, index = heapq.heappop(heap)
+                animation = self.animations[index]
+                gid = animation.gid_at(change_time)
+                if state[animation.gid] != gid:
+                    changes[animation.gid] = gid
+                    state[animation.gid] = gid
+                heapq.heappush(heap, (animation.next_change(change_time), index))
+            if changes:
+                yield time, changes
+
+    def frames(self, max_frames: int) -> Optional[Tuple[dict, List[Tuple[int, dict]], int]]:
+        """First state, change events and cycle time of at most "max_frames" frames.
+
+        Without quantum None is returned if cycle has more frames, with quantum cycle is cut after "max_frames"
+        frames.
+        """
+        state = self.state_at(0)
+        events = []
+        for time, changes in self.events():
+            if time == 0:
+                # changes inside first quantum are shown from the start
+                state.update(changes)
+                continue
+            if len(events) + 1 >= max_frames:
+                if not self.quantum:
+                    return None
+                return state, events, time
+            events.append((time, changes))
+        return state, events, self.period
@@ -1,13 +1,42 @@
-from typing import List
+from typing import Any, Callable, Hashable, Iterable, Iterator, List, Optional, Union
 import sys
+import base64
+import zlib
 import math
-from collections import defaultdict
+import threading
+import bisect
+import heapq
+import hashlib
+import operator
+from array import array
+from collections import defaultdict, OrderedDict
+try:
+    import zstandard
+    ZSTD_FOUND = True
+except ImportError:
+    ZSTD_FOUND = False
+try:
+    import numpy
+    NUMPY_FOUND = True
+except ImportError:
+    NUMPY_FOUND = False
 
 
 P28 = 2**8
 P216 = P28**2
 P224 = P28**3
 
+# TMX stores every gid as unsigned 32-bit little-endian integer.
+TILE_TYPECODE = 'I'
+TILE_SIZE = array(TILE_TYPECODE).itemsize
+# Tiles encoded at once by streaming encoders
+TILES_PIECE_SIZE = 2**16
+# gzip.compress default level
+GZIP_DEFAULT_COMPRESSION = 9
+ZSTD_DEFAULT_COMPRESSION = 3
+# Highest compressionlevel of every compression, lowest one is -1 (default level)
+MAX_COMPRESSION_LEVELS = {'gzip': 9, 'zlib': 9, 'zstd': 22}
+
 
 def int_or_none(value):
     if value is not None:
@@ -35,7 +64,7 @@ def get_size(obj, seen=None):
         size += sum([get_size(k, seen) for k in obj.keys()])
     elif hasattr(obj, '__dict__'):
         size += get_size(obj.__dict__, seen)
-    elif hasattr(obj, '__iter__') and not isinstance(obj, (str, bytes, bytearray)):
+    elif hasattr(obj, '__iter__') and not isinstance(obj, (str, bytes, bytearray, array)):
         size += sum([get_size(i, seen) for i in obj])
     return size
 
@@ -48,6 +77,114 @@ def get_four_bytes(tile: int) -> str:
     return tile % P28, tile // P28, tile // P216, tile // P224
 
 
+def tiles_from_bytes(source_bytes: bytes, compact: bool = False) -> Union[List[int], array]:
+    """Decode buffer of little-endian uint32 gids in one pass, list is made straight from buffer"""
+    source = memoryview(source_bytes)
+    source = source[:len(source) - len(source) % TILE_SIZE]
+    if compact or sys.byteorder == 'big':
+        tiles = array(TILE_TYPECODE)
+        tiles.frombytes(source)
+        if sys.byteorder == 'big':
+            tiles.byteswap()
+        return tiles if compact else tiles.tolist()
+    return source.cast(TILE_TYPECODE).tolist()
+
+
+def tiles_to_bytes(tiles: Union[List[int], array]) -> bytes:
+    """Encode gids as little-endian uint32 buffer in one pass"""
+    if isinstance(tiles, array) and tiles.typecode == TILE_TYPECODE and sys.byteorder == 'little':
+        return tiles.tobytes()
+    tiles = array(TILE_TYPECODE, tiles)
+    if sys.byteorder == 'big':
+        tiles.byteswap()
+    return tiles.tobytes()
+
+
+def iter_tiles_bytes(tiles: Union[List[int], array], piece_size: int = TILES_PIECE_SIZE) -> Iterator[bytes]:
+    for start in range(0, len(tiles), piece_size):
+        yield tiles_to_bytes(tiles[start:start + piece_size])
+
+
+def _zstandard():
+    if not ZSTD_FOUND:
+        raise ValueError('Compression format zstd needs "zstandard" module.')
+    return zstandard
+
+
+def iter_compressed(pieces: Iterable[bytes], compression: Optional[str], level: Optional[int] = None
+                    ) -> Iterator[bytes]:
+    """Compress stream of bytes pieces, gzip header has zero mtime.
+
+    "level" is TMX compressionlevel, None or -1 is default level of compression.
+    """
+    if compression is None:
+        yield from pieces
+        return
+    default = level is None or level == -1
+    if compression == 'zlib':
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if default else level, zlib.DEFLATED,
+                                      zlib.MAX_WBITS)
+    elif compression == 'gzip':
+        compressor = zlib.compressobj(GZIP_DEFAULT_COMPRESSION if default else level, zlib.DEFLATED,
+                                      zlib.MAX_WBITS | 16)
+    elif compression == 'zstd':
+        compressor = _zstandard().ZstdCompressor(level=ZSTD_DEFAULT_COMPRESSION if default else level).compressobj()
+    else:
+        raise ValueError("Compression format {} not supported.".format(compression))
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def zstd_decompress(data: bytes) -> bytes:
+    """Decompress zstd frame, content size may be missing from frame header"""
+    return _zstandard().ZstdDecompressor().decompressobj().decompress(data)
+
+
+def iter_base64(pieces: Iterable[bytes]) -> Iterator[str]:
+    """Base64 text of stream of bytes pieces, same as encoding joined pieces at once"""
+    rest = b''
+    for piece in pieces:
+        if rest:
+            piece = rest + piece
+        cut = len(piece) - len(piece) % 3
+        rest = piece[cut:]
+        if cut:
+            yield base64.b64encode(piece[:cut]).decode('latin1')
+    if rest:
+        yield base64.b64encode(rest).decode('latin1')
+
+
+def make_tiles(tiles: Iterable[int], compact: bool = False) -> Union[List[int], array]:
+    if compact:
+        return array(TILE_TYPECODE, tiles)
+    return list(tiles)
+
+
+def tiles_digest(tiles: Union[List[int], array]) -> bytes:
+    """Digest of gids, same for list and array of the same gids"""
+    digest = hashlib.blake2b(digest_size=16)
+    for piece in iter_tiles_bytes(tiles):
+        digest.update(piece)
+    return digest.digest()
+
+
+def valid_tiles(tiles: Union[List[int], array], structural: bool = False) -> bool:
+    """Compact tiles are checked by typecode, list tiles by set of their types, structural check skips list items"""
+    if isinstance(tiles, array):
+        return tiles.typecode == TILE_TYPECODE
+    if not isinstance(tiles, list):
+        return False
+    return structural or all(issubclass(tile_type, int) for tile_type in set(map(type, tiles)))
+
+
+def same_items(first: list, second: list) -> bool:
+    """Lists have the same objects in the same order, objects are compared by identity"""
+    return first is second or len(first) == len(second) and all(map(operator.is_, first, second))
+
+
 def count_types(elements: list):
     if not isinstance(elements, list):
         raise TypeError('elements must be list')
@@ -89,3 +226,96 @@ def gcd(a: List[int]) -> int:
     for i in a[1:]:
         _gcd = math.gcd(_gcd, i)
     return _gcd
+
+
+class LRUCache:
+    """Thread safe least recently used cache with hit/miss counters"""
+    def __init__(self, maxsize: int = 128) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def get(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                self._items.move_to_end(key)
+                return self._items[key]
+            self.misses += 1
+        value = factory()
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._items), 'maxsize': self.maxsize}
+
+
+class GidIndex:
+    """Sorted positions of every used gid in tiles list, empty tiles (gid 0) are not indexed"""
+    def __init__(self, tiles: Iterable[int]) -> None:
+        positions = defaultdict(list)
+        for index, gid in enumerate(tiles):
+            if gid:
+                positions[gid].append(index)
+        self._positions = dict(positions)
+
+    def __contains__(self, gid: int) -> bool:
+        return gid in self._positions
+
+    def used_gids(self) -> set:
+        return set(self._positions)
+
+    def positions(self, gid: int) -> List[int]:
+        return list(self._positions.get(gid, ()))
+
+    def count(self, gid: int) -> int:
+        return len(self._positions.get(gid, ()))
+
+    def pop(self, gid: int) -> List[int]:
+        return self._positions.pop(gid, [])
+
+    def add(self, gid: int, positions: List[int]) -> None:
+        """Add sorted positions of gid, positions of gid 0 are dropped"""
+        if not (gid and positions):
+            return
+        present = self._positions.get(gid)
+        self._positions[gid] = list(heapq.merge(present, positions)) if present else list(positions)
+
+    def set(self, index: int, old_gid: int, new_gid: int) -> None:
+        if old_gid == new_gid:
+            return
+        if old_gid:
+            positions = self._positions[old_gid]
+            del positions[bisect.bisect_left(positions, index)]
+            if not positions:
+                del self._positions[old_gid]
+        if new_gid:
+            bisect.insort(self._positions.setdefault(new_gid, []), index)
+
+
+def gids_positions(tiles: Iterable[int], gids: set) -> dict:
+    """Sorted positions of only "gids" in tiles as {gid: [position, ...]}, found in one pass"""
+    positions = defaultdict(list)
+    if gids:
+        for index, gid in enumerate(tiles):
+            if gid in gids:
+                positions[gid].append(index)
+    return positions
@@ -0,0 +1,300 @@
+from __future__ import annotations
+from typing import BinaryIO, List, Optional, Union
+from functools import reduce
+import abc
+import io
+import struct
+import zlib
+
+from PIL import Image, ImageChops, GifImagePlugin
+
+GIF_TRANSPARENT_INDEX = 255
+GIF_KEEP_FRAME = 1
+GIF_RESTORE_BACKGROUND = 2
+# GIF delay is 16-bit count of hundredths of second
+GIF_DURATION_MAX = (2**16 - 1) * 10
+# Pillow >= 7.0 takes plain ints: quantize method 0 is median cut, dither 0 is no dithering
+MEDIANCUT = 0
+NO_DITHER = 0
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+APNG_DISPOSE_NONE = 0
+APNG_BLEND_SOURCE = 0
+APNG_BLEND_OVER = 1
+# fcTL delay is 16-bit numerator over 16-bit denominator of seconds
+APNG_DELAY_MAX = 2**16 - 1
+APNG_DELAY_DENOMINATORS = (1000, 100, 10, 1)
+
+
+def apng_delay(duration: Optional[int]) -> tuple:
+    """fcTL (numerator, denominator) of duration in milliseconds, exact milliseconds while numerator fits,
+    then coarser units, longest delay is APNG_DELAY_MAX seconds"""
+    duration = duration or 0
+    for denominator in APNG_DELAY_DENOMINATORS:
+        numerator = round(duration * denominator / 1000)
+        if numerator <= APNG_DELAY_MAX:
+            return numerator, denominator
+    return APNG_DELAY_MAX, 1
+
+
+def changed_box(image: Image, other: Image) -> Optional[tuple]:
+    """Bounding box of pixels differing in any band"""
+    return reduce(ImageChops.lighter, ImageChops.difference(image, other).split()).getbbox()
+
+
+def gif_palette(frames: List[Image]) -> Image:
+    """Palette image of 255 colors quantized from first frame and parts changed by next frames,
+    index GIF_TRANSPARENT_INDEX is never chosen by remapping"""
+    parts = [frames[0]]
+    for previous, frame in zip(frames, frames[1:]):
+        box = changed_box(previous, frame)
+        if box:
+            parts.append(frame.crop(box))
+    sample = Image.new('RGB', (max(part.width for part in parts), sum(part.height for part in parts)))
+    y = 0
+    for part in parts:
+        sample.paste(part.convert('RGB'), (0, y))
+        y += part.height
+    palette = sample.quantize(colors=255, method=MEDIANCUT, dither=NO_DITHER).getpalette()[:255 * 3]
+    palette += palette[:3] * (256 - len(palette) // 3)
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette(palette)
+    return palette_image
+
+
+def paletted_frame(frame: Image, palette_image: Image) -> Image:
+    paletted = frame.convert('RGB').quantize(palette=palette_image, dither=NO_DITHER)
+    paletted.paste(GIF_TRANSPARENT_INDEX, mask=frame.getchannel('A').point(lambda alpha: 255 if alpha < 128 else 0))
+    return paletted
+
+
+def palette_indexes(paletted: Image) -> Image:
+    """Palette indexes of P image as L image"""
+    return Image.frombytes('L', paletted.size, paletted.tobytes())
+
+
+def transparent_mask(paletted: Image) -> Image:
+    return palette_indexes(paletted).point(lambda index: 255 if index == GIF_TRANSPARENT_INDEX else 0)
+
+
+def clears_pixels(images: List[Image]) -> bool:
+    """True if some frame, first frame after last too, is transparent where previous frame is not"""
+    transparent = [transparent_mask(image) for image in images]
+    return any(ImageChops.subtract(transparent[i], transparent[i - 1]).getbbox() for i in range(len(images)))
+
+
+def delta_frames(images: List[Image]) -> List[Image]:
+    """Frames with pixels unchanged since previous frame made transparent"""
+    indexes = [palette_indexes(image) for image in images]
+    result = [images[0]]
+    for i in range(1, len(images)):
+        unchanged = ImageChops.difference(indexes[i], indexes[i - 1]).point(lambda value: 0 if value else 255)
+        frame = images[i].copy()
+        frame.paste(GIF_TRANSPARENT_INDEX, mask=unchanged)
+        result.append(frame)
+    return result
+
+
+class FrameWriter(abc.ABC):
+    """Encoder taking RGBA frames one by one, "file" is name or binary file object, which is not closed"""
+
+    def __init__(self, file: Union[str, BinaryIO]) -> None:
+        if isinstance(file, str):
+            self.file = open(file, 'wb')
+            self._own_file = True
+        else:
+            self.file = file
+            self._own_file = False
+        self.frames_count = 0
+
+    @abc.abstractmethod
+    def write(self, frame: Image, duration: Optional[int] = None) -> None:
+        """Add frame shown for "duration" milliseconds, None is still image"""
+
+    def _finish(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self._finish()
+        if self._own_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def __enter__(self) -> FrameWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+class RawFrameWriter(FrameWriter):
+    """RGBA bytes of frames, for example for pipe to video encoder.
+
+    With "frame_time" in milliseconds every frame is repeated for its duration, so stream has constant frame rate.
+    """
+
+    def __init__(self, file: Union[str, BinaryIO], frame_time: Optional[int] = None) -> None:
+        super().__init__(file)
+        self.frame_time = frame_time
+
+    def write(self, frame: Image, duration: Optional[int] = None) -> None:
+        data = frame.convert('RGBA').tobytes()
+        repeat = max(1, round(duration / self.frame_time)) if self.frame_time and duration else 1
+        for _ in range(repeat):
+            self.file.write(data)
+        self.frames_count += repeat
+
+
+class GifFrameWriter(FrameWriter):
+    """Animated GIF written frame by frame.
+
+    Palette is quantized from first frame unless "palette_image" is given. Frame is written when next one comes:
+    it keeps only pixels changed since previous frame, unless next frame makes opaque pixel transparent and
+    whole frame has to be cleared after it.
+    """
+
+    def __init__(self, file: Union[str, BinaryIO], palette_image: Optional[Image] = None, loop: int = 0) -> None:
+        super().__init__(file)
+        self.palette_image = palette_image
+        self.loop = loop
+        self._first_transparent = None
+        self._previous = None
+        self._pending = None
+        self._pending_duration = None
+        self._pending_whole = True
+
+    def _write_header(self, size: tuple) -> None:
+        palette = bytes(self.palette_image.getpalette()[:256 * 3])
+        palette += bytes(256 * 3 - len(palette))
+        # global color table of 256 colors
+        self.file.write(b'GIF89a' + struct.pack('<HHBBB', size[0], size[1], 0xf7, GIF_TRANSPARENT_INDEX, 0))
+        self.file.write(palette)
+        self.file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\x00')
+
+    def _clears(self, paletted: Image, next_transparent: Image) -> bool:
+        return ImageChops.subtract(next_transparent, transparent_mask(paletted)).getbbox() is not None
+
+    def _flush(self, next_transparent: Image) -> bool:
+        """Write pending frame, True if whole canvas is cleared after it"""
+        clears = self._clears(self._pending, next_transparent)
+        image, offset = self._pending, (0, 0)
+        if not (self._pending_whole or clears):
+            current = palette_indexes(self._pending)
+            difference = ImageChops.difference(current, palette_indexes(self._previous))
+            box = difference.getbbox() or (0, 0, 1, 1)
+            image = self._pending.crop(box)
+            image.paste(GIF_TRANSPARENT_INDEX, mask=difference.crop(box).point(lambda value: 0 if value else 255))
+            offset = box[:2]
+        params = dict(transparency=GIF_TRANSPARENT_INDEX,
+                      disposal=GIF_RESTORE_BACKGROUND if clears else GIF_KEEP_FRAME)
+        if self._pending_duration:
+            params['duration'] = min(self._pending_duration, GIF_DURATION_MAX)
+        for data in GifImagePlugin.getdata(image, offset, **params):
+            self.file.write(data)
+        return clears
+
+    def write(self, frame: Image, duration: Optional[int] = None) -> None:
+        if self.palette_image is None:
+            self.palette_image = gif_palette([frame])
+        paletted = paletted_frame(frame, self.palette_image)
+        if self._pending is None:
+            self._write_header(frame.size)
+            self._first_transparent = transparent_mask(paletted)
+            whole = True
+        else:
+            whole = self._flush(transparent_mask(paletted))
+            self._previous = self._pending
+        self._pending, self._pending_duration, self._pending_whole = paletted, duration, whole
+        self.frames_count += 1
+
+    def _finish(self) -> None:
+        if self._pending is not None:
+            # first frame is drawn over last one when animation loops
+            self._flush(self._first_transparent)
+            self._pending = self._previous = None
+        self.file.write(b';')
+
+
+class ApngFrameWriter(FrameWriter):
+    """Animated PNG of full color frames written frame by frame, frames after first keep only pixels changed since
+    previous frame. Frames count is written when writer is closed, so file has to be seekable."""
+
+    def __init__(self, file: Union[str, BinaryIO], loop: int = 0) -> None:
+        super().__init__(file)
+        self.loop = loop
+        self._sequence = 0
+        self._actl_position = None
+        self._previous = None
+
+    def _write_chunk(self, chunk_type: bytes, data: bytes) -> None:
+        self.file.write(struct.pack('>I', len(data)) + chunk_type + data)
+        self.file.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    @staticmethod
+    def _png_chunks(image: Image) -> List[tuple]:
+        output = io.BytesIO()
+        image.save(output, 'PNG')
+        data = output.getvalue()
+        chunks = []
+        position = len(PNG_SIGNATURE)
+        while position < len(data):
+            length, chunk_type = struct.unpack('>I4s', data[position:position + 8])
+            chunks.append((chunk_type, data[position + 8:position + 8 + length]))
+            position += length + 12
+        return chunks
+
+    def _actl(self) -> bytes:
+        return struct.pack('>II', self.frames_count, self.loop)
+
+    def _delta(self, frame: Image) -> tuple:
+        """Box of pixels changed since previous frame, its image and blend operation.
+
+        Unchanged pixels of box are made transparent and blended over previous frame, unless some changed pixel
+        is translucent over visible one.
+        """
+        box = changed_box(self._previous, frame) or (0, 0, 1, 1)
+        image = frame.crop(box)
+        changed = reduce(ImageChops.lighter, ImageChops.difference(self._previous.crop(box), image).split())
+        changed = changed.point(lambda value: 255 if value else 0)
+        translucent = image.getchannel('A').point(lambda alpha: 255 if alpha < 255 else 0)
+        visible = self._previous.crop(box).getchannel('A').point(lambda alpha: 255 if alpha else 0)
+        if ImageChops.multiply(ImageChops.multiply(changed, translucent), visible).getbbox():
+            return box, image, APNG_BLEND_SOURCE
+        image.paste((0, 0, 0, 0), mask=ImageChops.invert(changed))
+        return box, image, APNG_BLEND_OVER
+
+    def write(self, frame: Image, duration: Optional[int] = None) -> None:
+        frame = frame.convert('RGBA')
+        if self._previous is None:
+            box, image, blend = (0, 0) + frame.size, frame, APNG_BLEND_SOURCE
+        else:
+            box, image, blend = self._delta(frame)
+        chunks = self._png_chunks(image)
+        if self._previous is None:
+            self.file.write(PNG_SIGNATURE)
+            self._write_chunk(b'IHDR', next(data for chunk_type, data in chunks if chunk_type == b'IHDR'))
+            self._actl_position = self.file.tell()
+            self._write_chunk(b'acTL', self._actl())
+        self._write_chunk(b'fcTL', struct.pack('>IIIIIHHBB', self._sequence, box[2] - box[0], box[3] - box[1],
+                                               box[0], box[1], *apng_delay(duration), APNG_DISPOSE_NONE, blend))
+        self._sequence += 1
+        for chunk_type, data in chunks:
+            if chunk_type != b'IDAT':
+                continue
+            if self._previous is None:
+                self._write_chunk(b'IDAT', data)
+            else:
+                self._write_chunk(b'fdAT', struct.pack('>I', self._sequence) + data)
+                self._sequence += 1
+        self._previous = frame
+        self.frames_count += 1
+
+    def _finish(self) -> None:
+        if self._previous is None:
+            return
+        self._write_chunk(b'IEND', b'')
+        end = self.file.tell()
+        self.file.seek(self._actl_position)
+        self._write_chunk(b'acTL', self._actl())
+        self.file.seek(end)
+        self._previous = None
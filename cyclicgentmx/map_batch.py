@@ -0,0 +1,222 @@
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field, asdict, replace
+from typing import Iterable, Iterator, List, Optional, Set
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from cyclicgentmx.map_base import MapBase
+
+# Maps submitted to pool and not finished yet per worker process, it bounds memory of parent process
+IN_FLIGHT_PER_PROCESS = 4
+# Characters making name a glob pattern
+GLOB_MAGIC = '*?['
+
+
+@dataclass
+class BatchOptions:
+    """What is done with every map, output dirs mirror input dirs below their common dir"""
+    validate: bool = True
+    structural: bool = False
+    save_dir: Optional[str] = None
+    image_dir: Optional[str] = None
+    image_format: str = 'gif'
+    compact: bool = False
+    lazy: bool = False
+    root_dir: Optional[str] = None
+
+
+@dataclass
+class BatchResult:
+    map_name: str
+    ok: bool
+    seconds: float
+    error: Optional[str] = None
+    outputs: List[str] = field(default_factory=list)
+
+
+def expand_maps(patterns: Iterable[str]) -> List[str]:
+    """Map names of glob patterns, "**" matches any dirs, names without glob magic are kept as they are"""
+    result = []
+    for pattern in patterns:
+        if any(char in pattern for char in GLOB_MAGIC):
+            result.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            result.append(pattern)
+    return result
+
+
+def _output_name(map_name: str, root_dir: str, output_dir: str, extension: str) -> str:
+    relative = os.path.relpath(os.path.abspath(map_name), root_dir)
+    output_name = os.path.join(output_dir, os.path.splitext(relative)[0] + extension)
+    os.makedirs(os.path.dirname(output_name), exist_ok=True)
+    return output_name
+
+
+def process_map(map_name: str, options: BatchOptions) -> BatchResult:
+    """Load, validate, save and draw one map, errors are returned in result.
+
+    Tilesets and tile atlases are taken from module caches, so maps of one worker process share them.
+    """
+    start = time.perf_counter()
+    outputs = []
+    root_dir = options.root_dir or os.path.dirname(os.path.abspath(map_name))
+    try:
+        tmx_map = MapBase.from_file(map_name, compact=options.compact, lazy=options.lazy)
+        if options.validate:
+            tmx_map.validate(structural=options.structural)
+        if options.save_dir:
+            output_name = _output_name(map_name, root_dir, options.save_dir, '.tmx')
+            tmx_map.save(output_name)
+            outputs.append(output_name)
+        if options.image_dir:
+            output_name = _output_name(map_name, root_dir, options.image_dir, '.' + options.image_format)
+            tmx_map.create_animated_image(output_name)
+            outputs.append(output_name)
+    except Exception as error:
+        return BatchResult(map_name, False, time.perf_counter() - start, '{}: {}'.format(type(error).__name__, error),
+                           outputs)
+    return BatchResult(map_name, True, time.perf_counter() - start, None, outputs)
+
+
+def read_checkpoint(checkpoint: str) -> Set[str]:
+    """Real paths of maps with ok results in checkpoint file, last line may be cut by interrupted batch"""
+    done = set()
+    if not os.path.exists(checkpoint):
+        return done
+    with open(checkpoint, encoding='utf-8') as checkpoint_file:
+        for line in checkpoint_file:
+            try:
+                result = json.loads(line)
+                if result['ok']:
+                    done.add(os.path.realpath(result['map_name']))
+            except (ValueError, KeyError):
+                continue
+    return done
+
+
+def run_batch(map_names: Iterable[str],
+              options: Optional[BatchOptions] = None,
+              processes: Optional[int] = None,
+              checkpoint: Optional[str] = None,
+              max_tasks_per_child: Optional[int] = None
+              ) -> Iterator[BatchResult]:
+    """Process maps in pool of processes and yield results as maps are finished.
+
+    Every result is appended to "checkpoint" JSON lines file, maps with ok results there are skipped, so
+    interrupted batch resumes with the same checkpoint and failed maps are tried again. Maps are matched by real
+    path, so other names of the same file are skipped too. Worker process is
+    replaced after "max_tasks_per_child" maps, it needs Python 3.11, module caches of worker are bounded anyway.
+    Pool broken by killed worker is created again, maps it was processing are tried again one at a time and map
+    breaking pool alone gets error result.
+    """
+    options = options or BatchOptions()
+    map_names = list(map_names)
+    if options.root_dir is None and map_names:
+        root_dir = os.path.commonpath([os.path.dirname(os.path.abspath(name)) for name in map_names])
+        options = replace(options, root_dir=root_dir)
+    if checkpoint:
+        done = read_checkpoint(checkpoint)
+        map_names = [name for name in map_names if os.path.realpath(name) not in done]
+    processes = processes or os.cpu_count()
+    pool_options = dict()
+    if max_tasks_per_child and sys.version_info >= (3, 11):
+        pool_options['max_tasks_per_child'] = max_tasks_per_child
+    checkpoint_file = open(checkpoint, 'a', encoding='utf-8') if checkpoint else None
+    executor = ProcessPoolExecutor(processes, **pool_options)
+    try:
+        names = iter(map_names)
+        # maps in flight when pool was broken
+        suspects = deque()
+        futures = dict()
+        while True:
+            try:
+                if suspects:
+                    if not futures:
+                        name = suspects.popleft()
+                        futures[executor.submit(process_map, name, options)] = (name, time.perf_counter(), True)
+                else:
+                    for name in names:
+                        future = executor.submit(process_map, name, options)
+                        futures[future] = (name, time.perf_counter(), False)
+                        if len(futures) >= processes * IN_FLIGHT_PER_PROCESS:
+                            break
+            except BrokenProcessPool:
+                suspects.append(name)
+            if not futures:
+                if suspects:
+                    executor.shutdown()
+                    executor = ProcessPoolExecutor(processes, **pool_options)
+                    continue
+                break
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in finished:
+                name, start, alone = futures.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool as error:
+                    broken = True
+                    if not alone:
+                        suspects.append(name)
+                        continue
+                    result = BatchResult(name, False, time.perf_counter() - start,
+                                         '{}: {}'.format(type(error).__name__, error))
+                if checkpoint_file:
+                    checkpoint_file.write(json.dumps(asdict(result)) + '\n')
+                    checkpoint_file.flush()
+                yield result
+            if broken:
+                # every map still in flight was in broken pool
+                suspects.extend(name for name, start, alone in futures.values())
+                futures.clear()
+                executor.shutdown()
+                executor = ProcessPoolExecutor(processes, **pool_options)
+    finally:
+        executor.shutdown()
+        if checkpoint_file:
+            checkpoint_file.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Load, validate, save and draw many TMX maps in parallel.')
+    parser.add_argument('maps', nargs='+', help='map names or glob patterns, "**" matches any dirs')
+    parser.add_argument('--no-validate', action='store_true', help='do not validate maps')
+    parser.add_argument('--structural', action='store_true', help='validate without checking every tile')
+    parser.add_argument('--save-dir', help='save maps into this dir')
+    parser.add_argument('--image-dir', help='save animated images of maps into this dir')
+    parser.add_argument('--image-format', choices=('gif', 'png', 'webp'), default='gif',
+                        help='format of animated images, png is APNG')
+    parser.add_argument('--compact', action='store_true', help='keep tiles as compact arrays')
+    parser.add_argument('--lazy', action='store_true', help='decode tiles on first access')
+    parser.add_argument('--processes', type=int, help='worker processes, all cores by default')
+    parser.add_argument('--checkpoint', help='JSON lines file of results, maps with ok results there are skipped')
+    parser.add_argument('--max-tasks-per-child', type=int, help='maps processed by one worker, Python 3.11+')
+    args = parser.parse_args(argv)
+
+    options = BatchOptions(validate=not args.no_validate, structural=args.structural, save_dir=args.save_dir,
+                           image_dir=args.image_dir, image_format=args.image_format,
+                           compact=args.compact, lazy=args.lazy)
+    map_names = expand_maps(args.maps)
+    done = read_checkpoint(args.checkpoint) if args.checkpoint else set()
+    total = sum(1 for name in map_names if os.path.realpath(name) not in done)
+    failed = 0
+    for number, result in enumerate(run_batch(map_names, options, args.processes, args.checkpoint,
+                                              args.max_tasks_per_child), 1):
+        status = 'ok' if result.ok else 'error'
+        line = '[{}/{}] {} {:.3f} s {}'.format(number, total, status, result.seconds, result.map_name)
+        if not result.ok:
+            failed += 1
+            line += ': ' + result.error
+        print(line, file=sys.stderr, flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,7 @@
 from __future__ import annotations
 import pathlib
 from cyclicgentmx.tmx_types import Layer, Data, Color
+from cyclicgentmx.helpers import make_tiles
 
 
 class MapCreate:
@@ -10,7 +11,7 @@ class MapCreate:
                      version: str = '1.2', tiledversion: str = '1.3.1', compressionlevel: int = -1,
                      renderorder: str = 'right-down', hexsidelength: int = None, staggeraxis: int = None,
                      staggerindex: int = None, backgroundcolor: str = None, infinite: bool = False,
-                     map_name: str = None
+                     map_name: str = None, compact: bool = False
                      ) -> MapCreate:
         self = cls()
         if map_name and isinstance(map_name.str):
@@ -44,10 +45,10 @@ class MapCreate:
 
         chunks = []
         if not infinite:
-            tiles = [0] * ((width - 1) * (height - 1))
+            tiles = make_tiles((0,), compact) * ((width - 1) * (height - 1))
             childs = tiles
         else:
-            tiles = []
+            tiles = make_tiles((), compact)
             childs = chunks
         data = Data(encoding="base64", compression="zlib", tiles=tiles, chunks=chunks, childs=childs)
         layer = Layer(id=1, name="Tile Layer 1", x=None, y=None, width=width, height=height,
@@ -0,0 +1,248 @@
+from __future__ import annotations
+from typing import Iterator, Optional, Tuple
+
+
+class Geometry:
+    """Pixel placement of map cells for one map orientation.
+
+    Anchor of cell is top left corner of its tile image, or bottom left corner when "bottom_aligned".
+    "cells" yields (index, x, y) anchors in draw order for all cells whose tile can intersect box,
+    it may yield some more cells around box.
+    "bounds" is (x, y, width, height) rectangle of map cells, whole map by default, cell (x, y) has index 0.
+    With "regular_grid" cells are rectangles of a grid and every tile fits in its cell, see "grid".
+    """
+    bottom_aligned = False
+    regular_grid = False
+
+    def __init__(self, tmx_map, line_number: Optional[int] = None,
+                 bounds: Optional[Tuple[int, int, int, int]] = None) -> None:
+        self.map = tmx_map
+        self.x, self.y, self.width, self.height = bounds if bounds else (0, 0, tmx_map.width, tmx_map.height)
+        self.tilewidth = tmx_map.tilewidth
+        self.tileheight = tmx_map.tileheight
+        self.line_number = line_number
+        if tmx_map.tilesets:
+            self.max_tile_width = max(tileset.tilewidth for tileset in tmx_map.tilesets)
+            self.max_tile_height = max(tileset.tileheight for tileset in tmx_map.tilesets)
+        else:
+            self.max_tile_width = self.tilewidth
+            self.max_tile_height = self.tileheight
+        self.tiles_overlap = True
+        self.size = self._size()
+        self._sub_geometries = dict()
+
+    def _size(self) -> Tuple[int, int]:
+        raise NotImplementedError
+
+    def _rows(self, first: int, last: int) -> range:
+        if self.line_number is not None:
+            if first <= self.line_number <= last:
+                return range(self.line_number, self.line_number + 1)
+            return range(0)
+        return range(max(first, 0), min(last, self.height - 1) + 1)
+
+    def anchor(self, i: int, j: int) -> Tuple[int, int]:
+        raise NotImplementedError
+
+    def tile_box(self, i: int, j: int, width: int, height: int) -> Tuple[int, int, int, int]:
+        x, y = self.anchor(i, j)
+        if self.bottom_aligned:
+            y -= height
+        return x, y, x + width, y + height
+
+    def cells(self, x0: int, y0: int, x1: int, y1: int) -> Iterator[Tuple[int, int, int]]:
+        raise NotImplementedError
+
+    def cells_box(self, i0: int, j0: int, i1: int, j1: int) -> Tuple[int, int, int, int]:
+        """Pixel box of map cells rectangle with images as big as map grid or biggest tile,
+        i1 and j1 are not included"""
+        i0, i1 = i0 - self.x, i1 - self.x
+        j0, j1 = j0 - self.y, j1 - self.y
+        width = max(self.tilewidth, self.max_tile_width)
+        height = max(self.tileheight, self.max_tile_height)
+        # staggered rows and columns are shifted by parity, so two first and last ones are enough for corners
+        boxes = [self.tile_box(i, j, width, height)
+                 for i in {i0, min(i0 + 1, i1 - 1), max(i1 - 2, i0), i1 - 1}
+                 for j in {j0, min(j0 + 1, j1 - 1), max(j1 - 2, j0), j1 - 1}]
+        return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+                max(box[2] for box in boxes), max(box[3] for box in boxes))
+
+    def intersects(self, x0: int, y0: int, x1: int, y1: int) -> bool:
+        """False if no tile of this geometry can be drawn inside box"""
+        size_x, size_y = self.size
+        return (x0 < size_x + self.max_tile_width and x1 > -self.max_tile_width
+                and y0 < size_y + self.max_tile_height and y1 > -self.max_tile_height)
+
+    def sub_geometry(self, x: int, y: int, width: int, height: int) -> Tuple[Geometry, int, int]:
+        """Geometry of cells rectangle, like chunk of infinite map, and shift of its pixels in this geometry"""
+        bounds = (x, y, width, height)
+        result = self._sub_geometries.get(bounds)
+        if result is None:
+            geometry = type(self)(self.map, None, bounds)
+            x0, y0 = self.anchor(x - self.x, y - self.y)
+            x1, y1 = geometry.anchor(0, 0)
+            result = geometry, x0 - x1, y0 - y1
+            self._sub_geometries[bounds] = result
+        return result
+
+
+class OrthogonalGeometry(Geometry):
+    bottom_aligned = True
+
+    def __init__(self, tmx_map, line_number: Optional[int] = None,
+                 bounds: Optional[Tuple[int, int, int, int]] = None) -> None:
+        self.renderorder = tmx_map.renderorder
+        super().__init__(tmx_map, line_number, bounds)
+        self.tiles_overlap = self.max_tile_width > self.tilewidth or self.max_tile_height > self.tileheight
+        self.regular_grid = not self.tiles_overlap
+
+    def _size(self) -> Tuple[int, int]:
+        if self.line_number is None:
+            return self.width * self.tilewidth, self.height * self.tileheight
+        return self.width * self.tilewidth, self.max_tile_height
+
+    def anchor(self, i: int, j: int) -> Tuple[int, int]:
+        if self.line_number is None:
+            return i * self.tilewidth, (j + 1) * self.tileheight
+        return i * self.tilewidth, self.max_tile_height
+
+    def cells(self, x0: int, y0: int, x1: int, y1: int) -> Iterator[Tuple[int, int, int]]:
+        tilewidth = self.tilewidth
+        tileheight = self.tileheight
+        width = self.width
+        columns = range(max((x0 - self.max_tile_width) // tilewidth, 0), min((x1 - 1) // tilewidth, width - 1) + 1)
+        if self.line_number is None:
+            rows = self._rows(y0 // tileheight - 1, (y1 + self.max_tile_height) // tileheight)
+        else:
+            rows = self._rows(self.line_number, self.line_number)
+        if self.renderorder in ('right-up', 'left-up'):
+            rows = reversed(rows)
+        if self.renderorder in ('left-down', 'left-up'):
+            columns = reversed(columns)
+        columns = list(columns)
+        for j in rows:
+            row = j * width
+            if self.line_number is None:
+                bottom = (j + 1) * tileheight
+            else:
+                bottom = self.max_tile_height
+            for i in columns:
+                yield row + i, i * tilewidth, bottom
+
+    def grid(self, x0: int, y0: int, x1: int, y1: int) -> Tuple[range, range, int, int]:
+        """Columns and rows of cells intersecting box and top left pixel of first of them"""
+        columns = range(max(x0 // self.tilewidth, 0), min((x1 - 1) // self.tilewidth, self.width - 1) + 1)
+        if self.line_number is None:
+            rows = range(max(y0 // self.tileheight, 0), min((y1 - 1) // self.tileheight, self.height - 1) + 1)
+            top = rows.start * self.tileheight
+        else:
+            rows = self._rows(self.line_number, self.line_number)
+            top = self.max_tile_height - self.tileheight
+        return columns, rows, columns.start * self.tilewidth, top
+
+
+class IsometricGeometry(Geometry):
+
+    def _size(self) -> Tuple[int, int]:
+        if self.line_number is None:
+            return (self.width + self.height) * self.tilewidth // 2, (self.width + self.height) * self.tileheight // 2
+        return (self.width + 1) * self.tilewidth // 2, (self.width + 2) * self.tileheight // 2
+
+    def anchor(self, i: int, j: int) -> Tuple[int, int]:
+        if self.line_number is None:
+            return (i - j + self.height - 1) * self.tilewidth // 2, (j + i - 2) * self.tileheight // 2
+        return i * self.tilewidth // 2, (i - 1) * self.tileheight // 2
+
+    def cells(self, x0: int, y0: int, x1: int, y1: int) -> Iterator[Tuple[int, int, int]]:
+        tilewidth = max(self.tilewidth, 1)
+        tileheight = max(self.tileheight, 1)
+        # u is horizontal and v is vertical diagonal coordinate of anchor, anchor is (u * tilewidth // 2,
+        # v * tileheight // 2)
+        u_first = 2 * (x0 - self.max_tile_width) // tilewidth - 1
+        u_last = 2 * x1 // tilewidth + 1
+        v_first = 2 * (y0 - self.max_tile_height) // tileheight - 1
+        v_last = 2 * y1 // tileheight + 1
+        width = self.width
+        if self.line_number is None:
+            for j in self._rows(0, self.height - 1):
+                first = max(u_first + j - self.height + 1, v_first - j + 2, 0)
+                last = min(u_last + j - self.height + 1, v_last - j + 2, width - 1)
+                row = j * width
+                for i in range(first, last + 1):
+                    x, y = self.anchor(i, j)
+                    yield row + i, x, y
+        else:
+            j = self.line_number
+            first = max(u_first, v_first + 1, 0)
+            last = min(u_last, v_last + 1, width - 1)
+            row = j * width
+            for i in range(first, last + 1):
+                x, y = self.anchor(i, j)
+                yield row + i, x, y
+
+
+class StaggeredGeometry(Geometry):
+    """Staggered and hexagonal maps, line_number is ignored as before"""
+
+    def __init__(self, tmx_map, line_number: Optional[int] = None,
+                 bounds: Optional[Tuple[int, int, int, int]] = None) -> None:
+        self.hexsidelength = tmx_map.hexsidelength if tmx_map.hexsidelength else 0
+        self.staggeraxis = tmx_map.staggeraxis
+        super().__init__(tmx_map, None, bounds)
+        # staggered cells are the ones of odd or even map column or row, not of bounds one
+        self.even = ((1 if tmx_map.staggerindex == 'even' else 0) + (self.y if self.staggeraxis == 'y' else self.x)) % 2
+
+    def _size(self) -> Tuple[int, int]:
+        hexsidelength = self.hexsidelength
+        if self.staggeraxis == 'y':
+            x_size = self.width * self.tilewidth + self.tilewidth // 2
+            y_size = (self.height + 1) * (self.tileheight + hexsidelength) // 2 - hexsidelength
+        else:
+            x_size = ((self.width + 1) * (self.tilewidth + hexsidelength)) // 2 - hexsidelength
+            y_size = self.height * self.tileheight + self.tileheight // 2
+        return x_size, y_size
+
+    def anchor(self, i: int, j: int) -> Tuple[int, int]:
+        hexsidelength = self.hexsidelength
+        if self.staggeraxis == 'y':
+            return (i * self.tilewidth + ((j + self.even) % 2) * self.tilewidth // 2,
+                    (j - 2) * (self.tileheight + hexsidelength) // 2 + hexsidelength)
+        return (i * (self.tilewidth + hexsidelength) // 2,
+                (j - 1) * self.tileheight + ((i + self.even) % 2) * self.tileheight // 2)
+
+    def cells(self, x0: int, y0: int, x1: int, y1: int) -> Iterator[Tuple[int, int, int]]:
+        hexsidelength = self.hexsidelength
+        if self.staggeraxis == 'y':
+            column_step = max(self.tilewidth, 1)
+            row_step = max(self.tileheight + hexsidelength, 1)
+            first_column = (x0 - self.max_tile_width - self.tilewidth) // column_step
+            last_column = x1 // column_step
+            rows = self._rows(2 * (y0 - self.max_tile_height - hexsidelength) // row_step + 1,
+                              2 * (y1 - hexsidelength) // row_step + 3)
+        else:
+            column_step = max(self.tilewidth + hexsidelength, 1)
+            row_step = max(self.tileheight, 1)
+            first_column = 2 * (x0 - self.max_tile_width) // column_step - 1
+            last_column = 2 * x1 // column_step + 1
+            rows = self._rows((y0 - self.max_tile_height - self.tileheight) // row_step,
+                              y1 // row_step + 2)
+        first_column = max(first_column, 0)
+        last_column = min(last_column, self.width - 1)
+        # odd columns are drawn before even ones for "even" stagger index and after them for "odd"
+        columns = []
+        for parity in (self.even, 1 - self.even):
+            columns.extend(range(first_column + (first_column + parity) % 2, last_column + 1, 2))
+        width = self.width
+        for j in rows:
+            row = j * width
+            for i in columns:
+                x, y = self.anchor(i, j)
+                yield row + i, x, y
+
+
+GEOMETRIES = {
+    'orthogonal': OrthogonalGeometry,
+    'isometric': IsometricGeometry,
+    'staggered': StaggeredGeometry,
+    'hexagonal': StaggeredGeometry,
+}
@@ -1,85 +1,156 @@
 from __future__ import annotations
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import groupby
+import math
+import multiprocessing
 import os
-from io import BytesIO
-try:
-    import numpy
-    NUMPY_FOUND = True
-except ImportError:
-    NUMPY_FOUND = False
-
-from PIL import Image
-from cyclicgentmx.tmx_types import MapError
+
+from PIL import Image, ImageChops
+from cyclicgentmx.tmx_types import MapError, Layer, Group, Data, Color
+from cyclicgentmx.helpers import NUMPY_FOUND, LRUCache, gids_positions, tiles_digest
+from cyclicgentmx.tile_atlas import TileAtlas, TileImages
+from cyclicgentmx.map_geometry import Geometry, GEOMETRIES
 from collections import defaultdict
 
-from cyclicgentmx.helpers import lcm
+from cyclicgentmx.animation_timeline import AnimationTimeline
+from cyclicgentmx.image_writer import (FrameWriter, ApngFrameWriter, GIF_TRANSPARENT_INDEX, GIF_KEEP_FRAME,
+                                       GIF_RESTORE_BACKGROUND, gif_palette, paletted_frame, clears_pixels, delta_frames)
+if NUMPY_FOUND:
+    from cyclicgentmx.numpy_render import GridRenderer
+
+PYRAMID_TILE_SIZE = 256
+# image formats of file extensions or "image_format" arguments
+IMAGE_FORMATS = {'gif': 'GIF', 'png': 'PNG', 'apng': 'PNG', 'webp': 'WEBP'}
+# libwebp effort from 0 (fast) to 6, lossless frames of tiles compress well with fast effort
+WEBP_METHOD = 0
+# images of layers kept by every map for render_image, every one is as large as map image,
+# cache grows to count of layers rendered at once
+LAYER_IMAGE_CACHE_SIZE = 16
+NO_TINT = (255, 255, 255, 255)
+# map, geometry and layers drawn by frame worker process
+_frame_worker_args = None
+
+
+@dataclass
+class RenderLayer:
+    """Tile layer as it is drawn, offsets, opacity and tint of its groups are applied"""
+    layer: Layer
+    offsetx: int = 0
+    offsety: int = 0
+    opacity: float = 1.0
+    tint: Tuple[int, int, int, int] = NO_TINT
+
+    @property
+    def name(self) -> str:
+        return self.layer.name
+
+    @property
+    def data(self) -> Data:
+        return self.layer.data
+
+    @property
+    def multiplier(self) -> Optional[Tuple[int, int, int, int]]:
+        """RGBA color multiplied with layer pixels, its alpha has opacity too, None if pixels are kept"""
+        multiplier = self.tint[:3] + (round(self.tint[3] * self.opacity),)
+        return None if multiplier == NO_TINT else multiplier
+
+
+def _tint(tint: Tuple[int, int, int, int], color: Optional[Color]) -> Tuple[int, int, int, int]:
+    if color is None:
+        return tint
+    color = (color.r, color.g, color.b, 255 if color.a is None else color.a)
+    return tuple(round(value * other / 255) for value, other in zip(tint, color))
+
+
+def _render_layers(childs: list, offsetx: float = 0.0, offsety: float = 0.0, opacity: float = 1.0,
+                   tint: Tuple[int, int, int, int] = NO_TINT) -> Iterator[RenderLayer]:
+    """Visible tile layers of childs and of their groups in drawing order, layers without opacity are skipped"""
+    for child in childs:
+        if not isinstance(child, (Layer, Group)) or child.visible is False:
+            continue
+        child_offsetx = offsetx + (child.offsetx or 0.0)
+        child_offsety = offsety + (child.offsety or 0.0)
+        child_opacity = opacity * (1.0 if child.opacity is None else child.opacity)
+        child_tint = _tint(tint, child.tintcolor)
+        if child_opacity <= 0:
+            continue
+        if isinstance(child, Group):
+            yield from _render_layers(child.childs, child_offsetx, child_offsety, child_opacity, child_tint)
+        else:
+            yield RenderLayer(child, round(child_offsetx), round(child_offsety), child_opacity, child_tint)
+
+
+def _tile_layers(childs: list) -> Iterator[Layer]:
+    """All tile layers of childs and of their groups, hidden ones too"""
+    for child in childs:
+        if isinstance(child, Group):
+            yield from _tile_layers(child.childs)
+        elif isinstance(child, Layer):
+            yield child
+
+
+def _tinted(image: Image, multiplier: Tuple[int, int, int, int]) -> Image:
+    return ImageChops.multiply(image, Image.new('RGBA', image.size, multiplier))
+
+
+def _downsampled(image: Image) -> Image:
+    """Image of half size, alpha is premultiplied while pixels are averaged"""
+    return image.convert('RGBa').reduce(2).convert('RGBA')
+
+
+def _init_frame_worker(tmx_map: MapImage, geometry: Geometry, layers: List[RenderLayer]) -> None:
+    global _frame_worker_args
+    _frame_worker_args = (tmx_map, geometry, layers)
+
+
+def _render_frame_worker(state: dict) -> bytes:
+    """Raw RGBA bytes of whole frame, they are passed back to parent process cheaper than pickled image"""
+    tmx_map, geometry, layers = _frame_worker_args
+    frame = Image.new('RGBA', geometry.size)
+    tmx_map._draw_layers(frame, (0, 0) + geometry.size, geometry, layers, state)
+    return frame.tobytes()
 
 
 class MapImage:
-    def _generate_lazy_tileset_images(self) -> List[Image]:
+    # "numpy" draws layers of regular grid geometries with NumPy, other geometries and "pil" paste tile by tile
+    render_backend = 'numpy' if NUMPY_FOUND else 'pil'
+
+    def _generate_lazy_tileset_images(self) -> TileImages:
         if hasattr(self, '_lazy_tileset_images'):
             return
-        result = [None, ]
+        atlases = list()
         for tileset in self.tilesets:
             source = os.path.normpath(os.path.join(self.file_dir, tileset.image.source))
-            tilset_image = Image.open(source)
-            if tilset_image.mode != 'RGBA':
-                tilset_image = tilset_image.convert(mode='RGBA', )
-            margin = tileset.margin if tileset.margin else 0
-            spacing = tileset.spacing if tileset.spacing else 0
-            height = tileset.tileheight
-            width = tileset.tilewidth
-            i_shift = spacing + width
-            j_shift = spacing + height
-            for j in range(tileset.tilecount // tileset.columns):
-                j_coord = margin + j_shift * j
-                for i in range(tileset.columns):
-                    result.append(tilset_image.crop((margin + i_shift * i, j_coord,
-                                                    margin + i_shift * i + width, j_coord + height),))
-        self._lazy_tileset_images = result
-
-    def _generate_animation_substitutions(self, max_frames: int = 50) -> dict:
-        if hasattr(self, '_animation_substitutions'):
-            return
-        animation_substitutions = defaultdict(dict)
-        all_animated_tile_gids = set()
-        tiles_frames = list()
-        durations = list()
-        for tileset in self.tilesets:
-            for tile in tileset.tiles:
-                if tile.animation:
-                    tile_id = tile.id + tileset.firstgid
-                    used_tile = any(tile_id in layer.data.tiles for layer in self.layers)
-                    if used_tile:
-                        duration_before = 0
-                        all_animated_tile_gids.add(tile_id)
-                        tile_animation_substitutions = defaultdict(dict)
-                        for frame in tile.animation.childs:
-                            time_element = tile_animation_substitutions[duration_before]
-                            time_element[tile_id] = frame.tileid + tileset.firstgid
-                            duration_before += frame.duration
-                        durations.append(duration_before)
-                        tile_frame = {'duration': duration_before, 'substitutions': tile_animation_substitutions}
-                        tiles_frames.append(tile_frame)
-        if not durations:
-            self._animation_substitutions = animation_substitutions
-            self._all_animated_tile_gids = all_animated_tile_gids
+            atlases.append((tileset.firstgid, TileAtlas.from_tileset(source, tileset)))
+        self._lazy_tileset_images = TileImages(atlases)
+
+    def _generate_animation_substitutions(self, max_frames: int = 50, quantum: Optional[int] = None) -> None:
+        """First gids, change events and cycle time of animated gids used by layers.
+
+        Cycle with more than "max_frames" frames raises MapError, with "quantum" its event times are rounded down
+        to quantum multiples and it is cut after "max_frames" frames instead.
+        """
+        used_gids = set()
+        for layer in self._tile_layers():
+            for part in [layer.data] + list(layer.data.chunks):
+                used_gids.update(part.used_gids())
+        timeline = AnimationTimeline.from_tilesets(self.tilesets, used_gids, quantum)
+        # timeline depends only on animated gids used by layers, not on their positions
+        key = (max_frames, quantum, frozenset(timeline.gids))
+        if getattr(self, '_animation_frames_key', None) == key:
             return
-        lcm_time = lcm(durations)
-        for tile_frame in tiles_frames:
-            frame_duration = tile_frame['duration']
-            substitutions = tile_frame['substitutions']
-            time_shift = 0
-            for i in range(lcm_time // frame_duration):
-                for time in substitutions:
-                    animation_substitutions[time + time_shift].update(substitutions[time])
-                time_shift += frame_duration
-        self._animation_substitutions = animation_substitutions
-        self._all_animated_tile_gids = all_animated_tile_gids
-        self._animation_time = lcm_time
-        frames_count = len(self._animation_substitutions)
-        if frames_count > max_frames:
-            raise MapError('Map has more frames({}) then max_frames({})'.format(frames_count, max_frames))
+        self._all_animated_tile_gids = timeline.gids
+        self._animation_start_state = dict()
+        self._animation_events = list()
+        self._animation_time = 0
+        if timeline.animations:
+            frames = timeline.frames(max_frames)
+            if frames is None:
+                raise MapError('Map has more frames then max_frames({})'.format(max_frames))
+            self._animation_start_state, self._animation_events, self._animation_time = frames
+        self._animation_frames_key = key
 
     @property
     def max_tileset_grid_high(self):
@@ -87,293 +158,557 @@ class MapImage:
             self._max_tileset_grid_high = max(tileset.tileheight for tileset in self.tilesets)
         return self._max_tileset_grid_high
 
+    def _chunks_bounds(self) -> Tuple[int, int, int, int]:
+        """(x, y, width, height) cells rectangle of all chunks of infinite map layers"""
+        chunks = [chunk for layer in self._tile_layers() for chunk in layer.data.chunks]
+        if not chunks:
+            raise MapError('Can not create image of infinite map without chunks.')
+        x0 = min(chunk.x for chunk in chunks)
+        y0 = min(chunk.y for chunk in chunks)
+        x1 = max(chunk.x + chunk.width for chunk in chunks)
+        y1 = max(chunk.y + chunk.height for chunk in chunks)
+        return x0, y0, x1 - x0, y1 - y0
+
+    def _geometry(self, line_number: Optional[int] = None) -> Geometry:
+        if not self.infinite:
+            return GEOMETRIES[self.orientation](self, line_number)
+        if line_number is not None:
+            raise MapError('Can not create image of line of infinite map.')
+        return GEOMETRIES[self.orientation](self, None, self._chunks_bounds())
+
+    def _layer_parts(self, layer: RenderLayer, geometry: Geometry) -> List[tuple]:
+        """(tiles owner, geometry, x, y) of layer data or of every chunk of infinite map layer,
+        x and y are shift of part pixels in geometry"""
+        if not self.infinite:
+            return [(layer.data, geometry, 0, 0)]
+        return [(chunk,) + geometry.sub_geometry(chunk.x, chunk.y, chunk.width, chunk.height)
+                for chunk in layer.data.chunks]
+
+    def _layers_tree(self) -> list:
+        """Tile layers and groups of map in drawing order"""
+        return [child for child in self.childs if isinstance(child, (Layer, Group))] or self.layers
+
+    def _tile_layers(self) -> List[Layer]:
+        return list(_tile_layers(self._layers_tree()))
+
+    def _selected_layers(self, layers_names: Optional[List[str]] = None) -> List[RenderLayer]:
+        """Visible tile layers as they are drawn, only layers of "layers_names" if they are given"""
+        layers = list(_render_layers(self._layers_tree()))
+        if layers_names:
+            return [layer for layer in layers if layer.name in layers_names]
+        return layers
+
     def _create_map_image_frame(self, substitution: Optional[dict] = None, previous_image: Optional[Image] = None,
                                 only_update: bool = False, layers_names: Optional[List[str]] = None,
                                 line_number: Optional[int] = None) -> Image:
-
-        if self.orientation == 'orthogonal':
-            return self._create_orthogonal_map_image_frame(substitution, previous_image,
-                                                           only_update, layers_names, line_number)
-
-        elif self.orientation == 'isometric':
-            return self._create_isometric_map_image_frame(substitution, previous_image,
-                                                          only_update, layers_names, line_number)
-
-        elif self.orientation in ('staggered', 'hexagonal'):
-            return self._create_staggered_map_image_frame(substitution, previous_image,
-                                                          only_update, layers_names, line_number)
-
-    def _create_orthogonal_map_image_frame(self, substitution: Optional[dict] = None,
-                                           previous_image: Optional[Image] = None,
-                                           only_update: bool = False,
-                                           layers_names: Optional[List[str]] = None,
-                                           line_number: Optional[int] = None
-                                           ) -> Image:
-        if self.infinite:
-            raise MapError('Can not create image of infinite map.')
-        tilewidth = self.tilewidth
-        tileheight = self.tileheight
-        width = self.width
-        height = self.height
-        if line_number is None:
-            height_range = range(height)
-            image_height = height * tileheight
-        else:
-            height_range = [line_number]
-            image_height = self.max_tileset_grid_high
-        width_range = range(width)
+        geometry = self._geometry(line_number)
         if not previous_image:
-            result_image = Image.new('RGBA', (width*tilewidth, image_height))
+            result_image = Image.new('RGBA', geometry.size)
         else:
             result_image = previous_image.copy()
-        if not substitution:
-            substitution = dict()
-        substitute = bool(substitution)
-        was_changed = False
-        if layers_names:
-            layers = [layer for layer in self.layers if layer.name in layers_names]
-        else:
-            layers = self.layers
-        for layer in layers:
-            if self.renderorder == 'right-up':
-                height_range = reversed(height_range)
-            elif self.renderorder == 'left-down':
-                width_range = reversed(width_range)
-            elif self.renderorder == 'left-up':
-                width_range = reversed(width_range)
-                height_range = reversed(height_range)
-            layer_image = Image.new('RGBA', (layer.width * tilewidth, image_height))
-            width_range = list(width_range)
-            height_range = list(height_range)
-            offsetx = round(layer.offsetx) if layer.offsetx else 0
-            offsety = round(layer.offsety) if layer.offsety else 0
-            for j in height_range:
-                j_compont = j * width
-                for i in width_range:
-                    tile_id = j_compont + i
-                    gid = layer.data.tiles[tile_id]
-                    old_gid = gid
-                    if substitute and only_update:
-                        gid = substitution.get(gid)
-                    else:
-                        gid = substitution.get(gid, gid)
-                    if gid is not None and old_gid != gid:
-                        was_changed = True
-                    if gid:
-                        image = self._lazy_tileset_images[gid]
-                        if line_number is None:
-                            delta_height = image.size[1] - tileheight
-                            layer_image.paste(image,
-                                              (i*tilewidth + offsetx, j * tileheight - delta_height + offsety),
-                                              image.convert('RGBA'))
-                        else:
-                            delta_height = image.size[1] - self._max_tileset_grid_high
-                            layer_image.paste(image,
-                                              (i * tilewidth + offsetx, - delta_height + offsety),
-                                              image.convert('RGBA'))
-            result_image = Image.alpha_composite(result_image, layer_image)
+        was_changed = self._draw_layers(result_image, (0, 0) + geometry.size, geometry,
+                                        self._selected_layers(layers_names), substitution, only_update)
         return result_image, was_changed
 
-    def _create_isometric_map_image_frame(self, substitution: Optional[dict] = None,
-                                          previous_image: Optional[Image] = None,
-                                          only_update: bool = False,
-                                          layers_names: Optional[List[str]] = None,
-                                          line_number: Optional[int] = None
-                                          ) -> Image:
-        if self.infinite:
-            raise MapError('Can not create image of infinite map.')
-        tilewidth = self.tilewidth
-        tileheight = self.tileheight
-        width = self.width
-        height = self.height
-        if line_number is None:
-            height_range = range(height)
-            x_size = (width + height) * tilewidth // 2
-            y_size = (width + height) * tileheight // 2
-        else:
-            height_range = [line_number]
-            x_size = (width + 1) * tilewidth // 2
-            y_size = (width + 2) * tileheight // 2
-        if not previous_image:
-            result_image = Image.new('RGBA', (x_size, y_size))
-        else:
-            result_image = previous_image.copy()
+    def render_region(self,
+                      x0: int,
+                      y0: int,
+                      x1: int,
+                      y1: int,
+                      layers_names: Optional[List[str]] = None,
+                      time_ms: Optional[int] = None,
+                      cells: bool = False
+                      ) -> Image:
+        """Image of map image pixels inside box, only tiles intersecting box are drawn.
+
+        With "cells" box is rectangle of map cells, x1 and y1 are not included, image covers their tiles.
+        With "time_ms" animated tiles show their frame at this time of animation, otherwise they are not animated.
+        Pixels out of map image are transparent.
+        """
+        self._generate_lazy_tileset_images()
+        geometry = self._geometry()
+        if cells:
+            x0, y0, x1, y1 = geometry.cells_box(x0, y0, x1, y1)
+        if not (x0 < x1 and y0 < y1):
+            raise MapError('Region must have positive width and height.')
+        substitution = None
+        if time_ms is not None:
+            substitution = AnimationTimeline.from_tilesets(self.tilesets).state_at(time_ms)
+        layers = self._selected_layers(layers_names)
+        image = Image.new('RGBA', (x1 - x0, y1 - y0))
+        size_x, size_y = geometry.size
+        box = (max(x0, 0), max(y0, 0), min(x1, size_x), min(y1, size_y))
+        if box == (x0, y0, x1, y1):
+            self._draw_layers(image, box, geometry, layers, substitution)
+        elif box[0] < box[2] and box[1] < box[3]:
+            region = Image.new('RGBA', (box[2] - box[0], box[3] - box[1]))
+            self._draw_layers(region, box, geometry, layers, substitution)
+            image.paste(region, (box[0] - x0, box[1] - y0))
+        return image
+
+    def _layer_image(self, geometry: Geometry, layer: RenderLayer, line_number: Optional[int],
+                     state: dict) -> Image:
+        """Cached image of layer with opacity and tint ignored, it is drawn again when digest of its tiles
+        or gid shown by its animated tiles changes"""
+        parts = [layer.data] + list(layer.data.chunks)
+        shown_gids = ()
+        if state:
+            used_gids = set()
+            for part in parts:
+                used_gids.update(part.used_gids())
+            shown_gids = tuple(sorted((gid, state[gid]) for gid in used_gids & state.keys() if state[gid] != gid))
+        bounds = self._chunks_bounds() if self.infinite else None
+        tiles = (tiles_digest(layer.data.tiles),) + tuple((chunk.x, chunk.y, chunk.width, chunk.height,
+                                                           tiles_digest(chunk.tiles)) for chunk in layer.data.chunks)
+        key = (tiles, layer.offsetx, layer.offsety, line_number, geometry.size, bounds, shown_gids)
+
+        def draw() -> Image:
+            image = Image.new('RGBA', geometry.size)
+            self._draw_tile_layers(image, (0, 0) + geometry.size, geometry, [layer], dict(shown_gids))
+            return image
+
+        return self._layer_images.get(key, draw)
+
+    def render_image(self,
+                     layers_names: Optional[List[str]] = None,
+                     time_ms: Optional[int] = None,
+                     line_number: Optional[int] = None
+                     ) -> Image:
+        """Image of map composited from cached images of its layers.
+
+        Layer image is drawn once for its tiles, offset and frames of animated tiles at "time_ms", opacity and
+        tint are applied while images are composited. So after change of visibility, opacity or tint of layers
+        image is only composited again, layer is drawn again after change of its tiles.
+        """
+        self._generate_lazy_tileset_images()
+        geometry = self._geometry(line_number)
+        state = dict()
+        if time_ms is not None:
+            state = AnimationTimeline.from_tilesets(self.tilesets).state_at(time_ms)
+        layers = self._selected_layers(layers_names)
+        if getattr(self, '_layer_images', None) is None:
+            self._layer_images = LRUCache(LAYER_IMAGE_CACHE_SIZE)
+        # smaller cache would drop image of every layer before it is rendered again
+        self._layer_images.maxsize = max(self._layer_images.maxsize, len(layers))
+        image = Image.new('RGBA', geometry.size)
+        for layer in layers:
+            layer_image = self._layer_image(geometry, layer, line_number, state)
+            if layer.multiplier is not None:
+                layer_image = _tinted(layer_image, layer.multiplier)
+            image.alpha_composite(layer_image)
+        return image
+
+    def _draw_layer_tiles(self, image: Image, draw_list: list, buffered: bool) -> None:
+        """Draw (TileImage, position) list as one layer composited over image.
+
+        Opaque and fully transparent pixels give the same result pasted straight on image. Translucent tiles
+        are composited one by one if they can not overlap, otherwise whole layer is drawn on its own buffer.
+        """
+        if buffered:
+            layer_image = Image.new('RGBA', image.size)
+            layer_image.load()
+            core = layer_image.im
+            for tile, (x, y) in draw_list:
+                core.paste(tile.core, (x, y, x + tile.width, y + tile.height), tile.mask_core)
+            image.alpha_composite(layer_image)
+            return
+        image.load()
+        core = image.im
+        for tile, (x, y) in draw_list:
+            if tile.translucent:
+                tile.composite(core, x, y)
+            else:
+                core.paste(tile.core, (x, y, x + tile.width, y + tile.height), tile.mask_core)
+
+    def _numpy_backend(self, geometry: Geometry) -> bool:
+        """True if layers of geometry are drawn by GridRenderer"""
+        if self.render_backend != 'numpy' or not geometry.regular_grid:
+            return False
+        if not NUMPY_FOUND:
+            raise MapError('Render backend "numpy" needs NumPy installed.')
+        if getattr(self, '_grid_renderer', None) is None:
+            self._grid_renderer = GridRenderer(self._lazy_tileset_images)
+        return True
+
+    def _draw_layers(self, image: Image, box: tuple, geometry: Geometry, layers: List[RenderLayer],
+                     substitution: Optional[dict] = None, only_update: bool = False) -> bool:
+        """Draw part of map inside box onto image, image top left corner is box top left corner.
+
+        Runs of layers without opacity and tint are drawn straight onto image, other layers are drawn onto
+        their own image composited with their opacity and tint.
+        With "only_update" only substituted gids are drawn. Returns True if some gid was substituted.
+        """
+        was_changed = False
+        for plain, run in groupby(layers, key=lambda layer: layer.multiplier is None):
+            if plain:
+                was_changed = self._draw_tile_layers(image, box, geometry, list(run), substitution,
+                                                     only_update) or was_changed
+                continue
+            for layer in run:
+                layer_image = Image.new('RGBA', image.size)
+                was_changed = self._draw_tile_layers(layer_image, box, geometry, [layer], substitution,
+                                                     only_update) or was_changed
+                image.alpha_composite(_tinted(layer_image, layer.multiplier))
+        return was_changed
+
+    def _draw_tile_layers(self, image: Image, box: tuple, geometry: Geometry, layers: List[RenderLayer],
+                          substitution: Optional[dict] = None, only_update: bool = False) -> bool:
+        """Same as _draw_layers with opacity and tint of layers ignored"""
         if not substitution:
             substitution = dict()
-        substitute = bool(substitution)
+        if self._numpy_backend(geometry):
+            layers_parts = []
+            for layer in layers:
+                layers_parts.append([(part, part_geometry, partx + layer.offsetx, party + layer.offsety)
+                                     for part, part_geometry, partx, party in self._layer_parts(layer, geometry)])
+            return self._grid_renderer.draw(image, box, layers_parts, substitution, only_update)
         was_changed = False
-        if layers_names:
-            layers = [layer for layer in self.layers if layer.name in layers_names]
-        else:
-            layers = self.layers
         for layer in layers:
-            layer_image = Image.new('RGBA', (x_size, y_size))
-            offsetx = round(layer.offsetx) if layer.offsetx else 0
-            offsety = round(layer.offsety) if layer.offsety else 0
-            for j in height_range:
-                tile_id = j * width
-                for i in range(width):
-                    gid = layer.data.tiles[tile_id]
-                    old_gid = gid
-                    if substitute and only_update:
-                        gid = substitution.get(gid)
-                    else:
-                        gid = substitution.get(gid, gid)
-                    if gid is not None and old_gid != gid:
-                        was_changed = True
-                    if gid:
-                        image = self._lazy_tileset_images[gid]
-                        if line_number is None:
-                            layer_image.paste(image,
-                                              ((i - j + height - 1) * tilewidth // 2 + offsetx,
-                                               (j + i - 2) * tileheight // 2 + offsety), image.convert('RGBA')
-                                              )
-                        else:
-                            layer_image.paste(image,
-                                              (i * tilewidth // 2 + offsetx,
-                                               (i - 1) * tileheight // 2 + offsety), image.convert('RGBA')
-                                              )
-                    tile_id += 1
-            result_image = Image.alpha_composite(result_image, layer_image)
-        return result_image, was_changed
+            parts = self._layer_parts(layer, geometry)
+            was_changed = self._draw_layer_parts(image, box, layer, parts, substitution, only_update) or was_changed
+        return was_changed
 
-    def _create_staggered_map_image_frame(self, substitution: Optional[dict] = None,
-                                          previous_image: Optional[Image] = None,
-                                          only_update: bool = False,
-                                          layers_names: Optional[List[str]] = None,
-                                          line_number: Optional[int] = None
-                                          ) -> Image:
-        if self.infinite:
-            raise MapError('Can not create image of infinite map.')
-        tilewidth = self.tilewidth
-        tileheight = self.tileheight
-        width = self.width
-        height = self.height
-        hexsidelength = self.hexsidelength if self.hexsidelength else 0
-        if self.staggeraxis == 'y':
-            x_size = width * tilewidth + tilewidth // 2
-            y_size = (height + 1) * (tileheight + hexsidelength) // 2 - hexsidelength
-        else:
-            x_size = ((width + 1) * (tilewidth + hexsidelength)) // 2 - hexsidelength
-            y_size = height * tileheight + tileheight // 2
-        if not previous_image:
-            result_image = Image.new('RGBA', (x_size, y_size))
-        else:
-            result_image = previous_image.copy()
-        if not substitution:
-            substitution = dict()
+    def _draw_layer_parts(self, image: Image, box: tuple, layer: RenderLayer, parts: List[tuple],
+                          substitution: dict, only_update: bool) -> bool:
+        """Draw tiles of layer parts inside box onto image, parts out of box cost nothing"""
+        x0, y0, x1, y1 = box
         substitute = bool(substitution)
         was_changed = False
-        if self.staggerindex == 'even':
-            even = 1
-            i_range = list(range(1, width, 2))
-            i_range.extend(list(range(0, width, 2)))
-        else:
-            even = 0
-            i_range = list(range(0, width, 2))
-            i_range.extend(list(range(1, width, 2)))
-        if layers_names:
-            layers = [layer for layer in self.layers if layer.name in layers_names]
-        else:
-            layers = self.layers
-        for layer in layers:
-            layer_image = Image.new('RGBA', (x_size, y_size))
-            offsetx = round(layer.offsetx) if layer.offsetx else 0
-            offsety = round(layer.offsety) if layer.offsety else 0
-            for j in range(layer.height):
-                j_width = j * width
-                for i in i_range:
-                    tile_id = j_width + i
-                    gid = layer.data.tiles[tile_id]
+        tile_images = self._lazy_tileset_images
+        offsetx, offsety = layer.offsetx, layer.offsety
+        draw_list = []
+        translucent = False
+        tiles_overlap = False
+        for part, geometry, partx, party in parts:
+            partx += offsetx
+            party += offsety
+            if not geometry.intersects(x0 - partx, y0 - party, x1 - partx, y1 - party):
+                continue
+            tiles = part.tiles
+            shiftx = partx - x0
+            shifty = party - y0
+            bottom_aligned = geometry.bottom_aligned
+            tiles_overlap = geometry.tiles_overlap
+            for tile_id, x, y in geometry.cells(x0 - partx, y0 - party, x1 - partx, y1 - party):
+                gid = tiles[tile_id]
+                if substitute:
                     old_gid = gid
-                    if substitute and only_update:
+                    if only_update:
                         gid = substitution.get(gid)
                     else:
                         gid = substitution.get(gid, gid)
                     if gid is not None and old_gid != gid:
                         was_changed = True
-                    if gid:
-                        image = self._lazy_tileset_images[gid]
-                        if self.staggeraxis == 'y':
-                            layer_image.paste(
-                                image,
-                                (i * tilewidth + ((j + even) % 2) * tilewidth // 2 + offsetx,
-                                 (j - 2) * (tileheight + hexsidelength) // 2 + hexsidelength + offsety),
-                                image.convert('RGBA')
-                            )
-                        else:
-                            layer_image.paste(
-                                image,
-                                (i * (tilewidth + hexsidelength) // 2 + offsetx,
-                                 (j - 1) * tileheight + ((i + even) % 2) * tileheight // 2 + offsety),
-                                image.convert('RGBA')
-                            )
-            result_image = Image.alpha_composite(result_image, layer_image)
-        return result_image, was_changed
+                if gid:
+                    tile = tile_images.tile(gid)
+                    translucent = translucent or tile.translucent
+                    if bottom_aligned:
+                        y -= tile.height
+                    draw_list.append((tile, (x + shiftx, y + shifty)))
+        self._draw_layer_tiles(image, draw_list, tiles_overlap and translucent)
+        return was_changed
+
+    @staticmethod
+    def _image_format(name: str, image_format: Optional[str] = None) -> str:
+        if image_format is None:
+            image_format = os.path.splitext(name)[1][1:] or 'gif'
+        image_format = image_format.lower()
+        if image_format not in IMAGE_FORMATS:
+            raise MapError('Unknown image format "{}", expected one of: {}.'.format(
+                image_format, ', '.join(IMAGE_FORMATS)))
+        return IMAGE_FORMATS[image_format]
 
     def save_image(self,
-                           name: str,
-                           frames: List[Image],
-                           duration: Optional[List[int]] = None
-                           ) -> None:
-        buffer = list()
-        for frame in frames:
-            buf = BytesIO()
-            buffer.append(buf)
-            paletted_frame = frame.convert('P', colors=256)
-            paletted_frame.save(buf, 'GIF', transparency=255)
-        images = list()
-        for buf in buffer:
-            im = Image.open(buf).convert('P')
-            shiftme = 256 - im.info['transparency']
-            palette = im.getpalette()
-            new_palette = (palette[-3 * shiftme:] + palette[:-3 * shiftme])
-            if NUMPY_FOUND:
-                im2 = Image.fromarray((numpy.array(im) + shiftme) % 256).convert('P')
-            else:
-                new_data = list((pix + shiftme) % 256 for pix in im.getdata())
-                im2 = Image.new('P', im.size)
-                im2.putdata(new_data)
-            im2.putpalette(new_palette)
-            images.append(im2)
-        image = images[0]
-        if duration:
-            image.save(name, 'GIF', save_all=True, append_images=images[1:], loop=0, duration=duration, transparency=0)
-        else:
-            image.save(name, 'GIF', transparency=0)
+                   name: str,
+                   frames: List[Image],
+                   duration: Optional[List[int]] = None,
+                   delta: bool = False,
+                   image_format: Optional[str] = None
+                   ) -> None:
+        """Save frames as GIF, APNG or WebP, format is "image_format" or extension of name.
+
+        GIF has one palette quantized once for all frames. With "delta" every frame after first keeps only pixels
+        changed since previous frame, it is ignored if some frame makes opaque pixel transparent.
+        APNG and lossless WebP keep full colors, APNG frames after first keep only box of changed pixels,
+        WebP encoder finds changed boxes itself.
+        """
+        image_format = self._image_format(name, image_format)
+        if image_format == 'PNG':
+            if not duration:
+                frames[0].save(name, 'PNG')
+                return
+            with ApngFrameWriter(name) as writer:
+                for frame, frame_duration in zip(frames, duration):
+                    writer.write(frame, frame_duration)
+            return
+        if image_format == 'WEBP':
+            if not duration:
+                frames[0].save(name, 'WEBP', lossless=True)
+                return
+            frames[0].save(name, 'WEBP', save_all=True, append_images=frames[1:], duration=duration, loop=0,
+                           lossless=True, method=WEBP_METHOD)
+            return
+        palette_image = gif_palette(frames)
+        images = [paletted_frame(frame, palette_image) for frame in frames]
+        # Pillow palette optimization would give frames own palettes and breaks delta frames transparency
+        if not duration:
+            images[0].save(name, 'GIF', optimize=False, transparency=GIF_TRANSPARENT_INDEX,
+                           background=GIF_TRANSPARENT_INDEX)
+            return
+        disposal = GIF_RESTORE_BACKGROUND
+        if delta and not clears_pixels(images):
+            images = delta_frames(images)
+            disposal = GIF_KEEP_FRAME
+        images[0].save(name, 'GIF', save_all=True, append_images=images[1:], loop=0, duration=duration,
+                       disposal=disposal, optimize=False, transparency=GIF_TRANSPARENT_INDEX,
+                       background=GIF_TRANSPARENT_INDEX)
+
+    def _animated_cells(self, geometry: Geometry, layers: List[RenderLayer], gids: set) -> dict:
+        """Positions of animated gids as {gid: [(layer, layer part, tile index), ...]}"""
+        cells = defaultdict(list)
+        for layer in layers:
+            for part in self._layer_parts(layer, geometry):
+                for gid, positions in gids_positions(part[0].tiles, gids).items():
+                    cells[gid].extend((layer, part, index) for index in positions)
+        return cells
+
+    def _dirty_boxes(self, geometry: Geometry, animated_cells: dict, changed: dict, state: dict) -> List[tuple]:
+        """Image boxes covered by old and new images of changed animated tiles, clipped and merged by rows"""
+        tile_images = self._lazy_tileset_images
+        size_x, size_y = geometry.size
+        boxes = list()
+        for gid, new_gid in changed.items():
+            old_tile = tile_images.tile(state.get(gid, gid))
+            new_tile = tile_images.tile(new_gid)
+            for layer, (part, part_geometry, partx, party), index in animated_cells[gid]:
+                j, i = divmod(index, part_geometry.width)
+                if part_geometry.line_number is not None and j != part_geometry.line_number:
+                    continue
+                offsetx = partx + layer.offsetx
+                offsety = party + layer.offsety
+                old_box = part_geometry.tile_box(i, j, old_tile.width, old_tile.height)
+                new_box = part_geometry.tile_box(i, j, new_tile.width, new_tile.height)
+                box = (max(min(old_box[0], new_box[0]) + offsetx, 0),
+                       max(min(old_box[1], new_box[1]) + offsety, 0),
+                       min(max(old_box[2], new_box[2]) + offsetx, size_x),
+                       min(max(old_box[3], new_box[3]) + offsety, size_y))
+                if box[0] < box[2] and box[1] < box[3]:
+                    boxes.append(box)
+        boxes.sort(key=lambda box: (box[1], box[3], box[0]))
+        merged = list()
+        for box in boxes:
+            if merged:
+                last = merged[-1]
+                if last[1] == box[1] and last[3] == box[3] and box[0] <= last[2]:
+                    merged[-1] = (last[0], last[1], max(last[2], box[2]), last[3])
+                    continue
+            merged.append(box)
+        return merged
+
+    def _animation_steps(self, geometry: Geometry, layers: List[RenderLayer]
+                         ) -> Iterator[Tuple[int, List[tuple], dict]]:
+        """(time, dirty boxes, state) of first animation step and of every next step changing some pixels,
+        state is gid shown now for every animated gid and it is updated in place"""
+        animated_cells = self._animated_cells(geometry, layers, self._all_animated_tile_gids)
+        state = dict(self._animation_start_state)
+        yield 0, [(0, 0) + geometry.size], state
+        for substitution_time, changes in self._animation_events:
+            changed = {gid: new_gid for gid, new_gid in changes.items() if state.get(gid, gid) != new_gid}
+            if not changed:
+                continue
+            boxes = self._dirty_boxes(geometry, animated_cells, changed, state)
+            state.update(changed)
+            if boxes:
+                yield substitution_time, boxes, state
+
+    def _render_frames(self, geometry: Geometry, layers: List[RenderLayer], steps: List[dict],
+                       processes: int) -> List[Image]:
+        """Whole frames of animation states drawn in pool of forked processes, which share tile atlases"""
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(processes, context, _init_frame_worker, (self, geometry, layers)) as executor:
+            frames = executor.map(_render_frame_worker, steps)
+            return [Image.frombytes('RGBA', geometry.size, frame) for frame in frames]
+
+    def iter_animation_frames(self,
+                              layers_names: Optional[List[str]] = None,
+                              line_number: Optional[int] = None,
+                              max_frames: int = 50,
+                              quantum: Optional[int] = None
+                              ) -> Iterator[Tuple[int, Optional[int], Image]]:
+        """Yield (time, duration, frame) of animation one frame after another, times are in milliseconds.
+
+        Every frame is copy of previous one with changed regions drawn again, so at most two frames are kept.
+        Yielded frame must not be changed. Map without animation gives one frame with duration None.
+        "max_frames" and "quantum" are as in create_animated_image.
+        """
+        self._generate_lazy_tileset_images()
+        self._generate_animation_substitutions(max_frames, quantum)
+
+        if not self._all_animated_tile_gids:
+            frame, was_changed = self._create_map_image_frame(layers_names=layers_names, line_number=line_number)
+            yield 0, None, frame
+            return
+
+        geometry = self._geometry(line_number)
+        layers = self._selected_layers(layers_names)
+        frame, frame_time = None, 0
+        for substitution_time, boxes, state in self._animation_steps(geometry, layers):
+            if frame is None:
+                frame = Image.new('RGBA', geometry.size)
+                self._draw_layers(frame, boxes[0], geometry, layers, state)
+                continue
+            yield frame_time, substitution_time - frame_time, frame
+            frame = frame.copy()
+            for box in boxes:
+                region = Image.new('RGBA', (box[2] - box[0], box[3] - box[1]))
+                self._draw_layers(region, box, geometry, layers, state)
+                frame.paste(region, box)
+            frame_time = substitution_time
+        yield frame_time, self._animation_time - frame_time, frame
+
+    def write_animation(self,
+                        writer: FrameWriter,
+                        layers_names: Optional[List[str]] = None,
+                        line_number: Optional[int] = None,
+                        max_frames: int = 50,
+                        quantum: Optional[int] = None
+                        ) -> None:
+        """Pass animation frames to writer as they are drawn and close it"""
+        with writer:
+            for frame_time, duration, frame in self.iter_animation_frames(layers_names, line_number, max_frames,
+                                                                          quantum):
+                writer.write(frame, duration)
 
     def create_animated_image(self,
                               name: str,
                               layers_names: Optional[List[str]] = None,
-                              line_number: Optional[int] = None
+                              line_number: Optional[int] = None,
+                              delta: bool = False,
+                              processes: Optional[int] = None,
+                              max_frames: int = 50,
+                              quantum: Optional[int] = None,
+                              image_format: Optional[str] = None
                               ) -> Image:
+        """Save animated GIF, APNG or WebP of map, format is "image_format" or extension of name.
+
+        Every frame is previous one with changed regions drawn again. With "processes" > 1 every frame is drawn
+        whole in a pool of this many processes, it needs "fork" start method and falls back to one process without it.
+        Animation with more than "max_frames" frames raises MapError, with "quantum" in milliseconds its frame times
+        are rounded down to quantum multiples and it is cut after "max_frames" frames instead.
+        All frames are kept in memory, write_animation keeps only two of them.
+        """
+        self._image_format(name, image_format)
         self._generate_lazy_tileset_images()
-        self._generate_animation_substitutions()
+        self._generate_animation_substitutions(max_frames, quantum)
 
-        if not self._animation_substitutions:
-            frame, was_changed = self._create_map_image_frame(line_number=line_number)
-            self.save_image(name, [frame])
+        if (self._all_animated_tile_gids and processes and processes > 1
+                and 'fork' in multiprocessing.get_all_start_methods()):
+            geometry = self._geometry(line_number)
+            layers = self._selected_layers(layers_names)
+            times = list()
+            steps = list()
+            for substitution_time, boxes, state in self._animation_steps(geometry, layers):
+                times.append(substitution_time)
+                steps.append(dict(state))
+            frames = self._render_frames(geometry, layers, steps, processes)
+            times.append(self._animation_time)
+            duration = [next_time - time for time, next_time in zip(times, times[1:])]
+            self.save_image(name, frames, duration, delta, image_format)
             return
 
         frames = list()
-        prev_frame = None
         duration = list()
-        prev_time = None
-        only_update = False
-        for substitution_time in sorted(self._animation_substitutions.keys()):
-            frame, was_changed = self._create_map_image_frame(self._animation_substitutions[substitution_time],
-                                                              prev_frame,
-                                                              only_update,
-                                                              layers_names,
-                                                              line_number=line_number)
-            only_update = True
-            if not prev_frame or was_changed:
-                frames.append(frame)
-                if prev_time is not None:
-                    duration.append(substitution_time - prev_time)
-                    prev_time = substitution_time
-                else:
-                    prev_time = 0
-                prev_frame = frame
-        duration.append(self._animation_time - prev_time)
-        self.save_image(name, frames, duration)
+        for frame_time, frame_duration, frame in self.iter_animation_frames(layers_names, line_number, max_frames,
+                                                                            quantum):
+            frames.append(frame)
+            duration.append(frame_duration)
+        if duration[0] is None:
+            self.save_image(name, frames, image_format=image_format)
+        else:
+            self.save_image(name, frames, duration, delta, image_format)
+
+    def _create_chunk_images(self, layers_names: Optional[List[str]] = None) -> Dict[Tuple[int, int], Image]:
+        """Image of every chunk of infinite map as {(chunk x, chunk y): image}, chunks of all layers at the same
+        cells are drawn on one image"""
+        if not self.infinite:
+            raise MapError('Map is not infinite and has no chunks.')
+        layers_chunks = defaultdict(list)
+        for layer in self._selected_layers(layers_names):
+            for chunk in layer.data.chunks:
+                layers_chunks[chunk.x, chunk.y].append((layer, chunk))
+        images = dict()
+        for (x, y), chunks in layers_chunks.items():
+            first_chunk = chunks[0][1]
+            geometry = GEOMETRIES[self.orientation](self, None, (x, y, first_chunk.width, first_chunk.height))
+            image = Image.new('RGBA', geometry.size)
+            for layer, chunk in chunks:
+                part = (chunk,) + geometry.sub_geometry(x, y, chunk.width, chunk.height)
+                layer_image = image if layer.multiplier is None else Image.new('RGBA', geometry.size)
+                self._draw_layer_parts(layer_image, (0, 0) + geometry.size, layer, [part], dict(), False)
+                if layer_image is not image:
+                    image.alpha_composite(_tinted(layer_image, layer.multiplier))
+            images[x, y] = image
+        return images
+
+    def create_chunk_images(self, name: str, layers_names: Optional[List[str]] = None) -> None:
+        """Save image of every chunk of infinite map, "name" is formatted with chunk "x" and "y" like
+        "chunk_{x}_{y}.gif". Image of whole infinite map is created by "create_animated_image"."""
+        self._generate_lazy_tileset_images()
+        for (x, y), image in self._create_chunk_images(layers_names).items():
+            self.save_image(name.format(x=x, y=y), [image])
+
+    def _pyramid_tile(self, directory: str, zoom: int, x: int, y: int, max_zoom: int, tile_size: int,
+                      geometry: Geometry, layers: List[RenderLayer]) -> Optional[Image]:
+        """Save z/x/y tile and return its image, or None if tile is empty. Tile of max_zoom is drawn from map cells
+        overlapping it, lower zoom tile is downsampled from four tiles of next zoom"""
+        scale = 2 ** (max_zoom - zoom)
+        size_x, size_y = geometry.size
+        if x * tile_size * scale >= size_x or y * tile_size * scale >= size_y:
+            return None
+        if zoom == max_zoom:
+            image = Image.new('RGBA', (tile_size, tile_size))
+            # tiles at right and bottom edges of map image are cut by it, like render_region
+            box = (x * tile_size, y * tile_size, min((x + 1) * tile_size, size_x), min((y + 1) * tile_size, size_y))
+            if box[2] - box[0] == box[3] - box[1] == tile_size:
+                self._draw_layers(image, box, geometry, layers)
+            else:
+                region = Image.new('RGBA', (box[2] - box[0], box[3] - box[1]))
+                self._draw_layers(region, box, geometry, layers)
+                image.paste(region, (0, 0))
+            if not image.getbbox():
+                return None
+        else:
+            image = None
+            for j in (0, 1):
+                for i in (0, 1):
+                    child = self._pyramid_tile(directory, zoom + 1, 2 * x + i, 2 * y + j, max_zoom, tile_size,
+                                               geometry, layers)
+                    if child is None:
+                        continue
+                    if image is None:
+                        image = Image.new('RGBA', (2 * tile_size, 2 * tile_size))
+                    image.paste(child, (i * tile_size, j * tile_size))
+            if image is None:
+                return None
+            image = _downsampled(image)
+        tile_dir = os.path.join(directory, str(zoom), str(x))
+        os.makedirs(tile_dir, exist_ok=True)
+        image.save(os.path.join(tile_dir, '{}.png'.format(y)), 'PNG')
+        return image
+
+    def create_tile_pyramid(self,
+                            directory: str,
+                            tile_size: int = PYRAMID_TILE_SIZE,
+                            layers_names: Optional[List[str]] = None
+                            ) -> int:
+        """Save map image as "directory/z/x/y.png" tiles of slippy map pyramid without drawing whole map image.
+
+        Whole map fits one tile of zoom 0, every next zoom doubles size and last zoom has map pixels as they are.
+        Empty tiles are not saved. Returns last zoom.
+        """
+        self._generate_lazy_tileset_images()
+        geometry = self._geometry()
+        layers = self._selected_layers(layers_names)
+        max_zoom = max(0, math.ceil(math.log2(max(geometry.size) / tile_size)))
+        self._pyramid_tile(directory, 0, 0, 0, max_zoom, tile_size, geometry, layers)
+        return max_zoom
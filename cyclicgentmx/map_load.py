@@ -7,7 +7,7 @@ from cyclicgentmx.helpers import int_or_none
 
 class MapLoad:
     @classmethod
-    def from_file(cls, map_name: str) -> MapLoad:
+    def from_file(cls, map_name: str, compact: bool = False, lazy: bool = False) -> MapLoad:
         self = cls()
         self.file_dir = pathlib.PurePath(map_name).parent
         self.properties = None
@@ -18,9 +18,10 @@ class MapLoad:
         self.imagelayers = []
         self.groups = []
 
-        tree = ET.parse(map_name)
-        root = tree.getroot()
-
+        # Top-level children are built one by one and dropped right after, so only one of them is kept
+        # in memory at the same time.
+        context = ET.iterparse(map_name, events=('start', 'end'))
+        event, root = next(context)
         self.version = root.attrib.get("version", None)
         self.tiledversion = root.attrib.get("tiledversion", None)
         self.compressionlevel = int_or_none(root.attrib.get("compressionlevel", None))
@@ -38,7 +39,15 @@ class MapLoad:
         self.nextobjectid = int_or_none(root.attrib.get("nextobjectid", None))
         self.infinite = bool(int(root.attrib.get("infinite")))
 
-        for child in root:
+        depth = 1
+        for event, child in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            root.clear()
             if child.tag == 'properties':
                 child_object = Properties.from_element(child)
                 self.properties = child_object
@@ -46,7 +55,7 @@ class MapLoad:
                 child_object = TileSet.from_element(child, self.file_dir)
                 self.tilesets.append(child_object)
             elif child.tag == 'layer':
-                child_object = Layer.from_element(child)
+                child_object = Layer.from_element(child, compact, lazy, self.compressionlevel)
                 self.layers.append(child_object)
             elif child.tag == 'objectgroup':
                 child_object = ObjectGroup.from_element(child)
@@ -55,7 +64,7 @@ class MapLoad:
                 child_object = ImageLayer.from_element(child)
                 self.imagelayers.append(child_object)
             elif child.tag == 'group':
-                child_object = Group.from_element(child)
+                child_object = Group.from_element(child, compact, lazy, self.compressionlevel)
                 self.groups.append(child_object)
             else:
                 continue
@@ -1,12 +1,17 @@
 from __future__ import annotations
 import pathlib
 import xml.etree.ElementTree as ET
-from cyclicgentmx.helpers import clear_dict_from_none, indent
+from cyclicgentmx.helpers import clear_dict_from_none
+from cyclicgentmx.tmx_writer import TmxWriter
+
+# Buffer size of file written by save
+SAVE_BUFFER_SIZE = 2**16
 
 
 class MapSave:
 
-    def save(self, map_name: str) -> None:
+    def get_root_element(self) -> ET.Element:
+        """Map element without childs"""
         attrib = {
             'version': self.version,
             'tiledversion': self.tiledversion,
@@ -25,11 +30,12 @@ class MapSave:
             'nextobjectid': self.nextobjectid,
             'infinite': '1' if self.infinite else '0'
         }
-        new_file_dir = pathlib.PurePath(map_name).parent
-        root = ET.Element('map', attrib=clear_dict_from_none(attrib))
-        for child in self.childs:
-            root.append(child.get_element(self.file_dir, new_file_dir))
+        return ET.Element('map', attrib=clear_dict_from_none(attrib))
 
-        indent(root)
-        tree = ET.ElementTree(root)
-        tree.write(map_name, encoding="UTF-8", xml_declaration=True)
+    def save(self, map_name: str) -> None:
+        new_file_dir = pathlib.PurePath(map_name).parent
+        with open(map_name, 'w', encoding='utf-8', errors='xmlcharrefreplace', newline='\n',
+                  buffering=SAVE_BUFFER_SIZE) as file:
+            writer = TmxWriter(file.write, self.file_dir, new_file_dir, self.compressionlevel)
+            writer.write_declaration()
+            writer.write_parent(self.get_root_element(), self.childs, 0, '\n' if self.childs else None)
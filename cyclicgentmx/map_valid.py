@@ -1,7 +1,8 @@
 from __future__ import annotations
 import itertools
 import pathlib
-from cyclicgentmx.tmx_types import Layer, MapValidationError, MapIntValidationError, Properties, TileSet, \
+from cyclicgentmx.helpers import MAX_COMPRESSION_LEVELS
+from cyclicgentmx.tmx_types import Data, Layer, MapValidationError, MapIntValidationError, Properties, TileSet, \
     ObjectGroup, ImageLayer, Group
 
 
@@ -11,7 +12,21 @@ class MapValid:
                                       'tiledversion', 'compressionlevel', 'renderorder', 'nextlayerid', 'nextobjectid'))
     HEXAGONAL_MANDATORY_FIELDS = frozenset(('hexsidelength', 'staggeraxis', 'staggerindex'))
 
-    def validate(self):
+    def _map_level_compressions(self) -> set:
+        """Compressions of layers data, groups layers too, written with compressionlevel of map"""
+        compressions = set()
+        parents = [self]
+        while parents:
+            parent = parents.pop()
+            for layer in parent.layers:
+                data = getattr(layer, 'data', None)
+                if isinstance(data, Data) and data.compression and data.compressionlevel is None:
+                    compressions.add(data.compression)
+            parents.extend(group for group in parent.groups if isinstance(group, Group))
+        return compressions
+
+    def validate(self, structural: bool = False) -> None:
+        """Structural validation checks map tree without checking every tile of layers"""
         all_fields = self.__dict__.keys()
         missing_fields = self.MAP_MANDATORY_FIELDS.difference(all_fields)
         if missing_fields:
@@ -30,8 +45,10 @@ class MapValid:
             raise MapIntValidationError(('width', 'height', 'tilewidth', 'tileheight',
                                          'nextlayerid', 'nextobjectid'), 0)
 
-        if not (isinstance(self.compressionlevel, int) and -2 < self.compressionlevel < 10):
-            raise MapIntValidationError('compressionlevel', -2, 10)
+        max_level = min((MAX_COMPRESSION_LEVELS.get(compression, 9) for compression in self._map_level_compressions()),
+                        default=9)
+        if not (isinstance(self.compressionlevel, int) and -2 < self.compressionlevel <= max_level):
+            raise MapIntValidationError('compressionlevel', -2, max_level + 1)
 
         if self.renderorder not in ('right-down', 'right-up', 'left-down', 'left-up'):
             raise MapValidationError('Field "renderorder" must be in '
@@ -86,7 +103,7 @@ class MapValid:
         for layer in self.layers:
             if not isinstance(layer, Layer):
                 raise MapValidationError('layer in layers must be Layer type')
-            layer.validate()
+            layer.validate(structural)
         for objectgroup in self.objectgroups:
             if not isinstance(objectgroup, ObjectGroup):
                 raise MapValidationError('objectgroup in objectgroups must be ObjectGroup type')
@@ -98,11 +115,12 @@ class MapValid:
         for group in self.groups:
             if not isinstance(group, Group):
                 raise MapValidationError('group in groups must be Group type')
-            group.validate()
+            group.validate(structural)
         childs_from_lists = list(itertools.chain(self.tilesets, self.layers, self.objectgroups,
                                                  self.imagelayers, self.groups))
         childs_from_lists.append(self.properties)
-        if not all(item in self.childs for item in childs_from_lists)\
-                and not all(item in childs_from_lists for item in self.childs):
+        childs_ids = set(map(id, self.childs))
+        ids_from_lists = set(map(id, childs_from_lists))
+        if not (ids_from_lists <= childs_ids or childs_ids <= ids_from_lists):
             raise MapValidationError('items in "childs" not equal all items in "properties", "tilesets", "layers",'
                                      '"objectgroups", "imagelayers" and "groups"')
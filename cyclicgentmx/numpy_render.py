@@ -0,0 +1,207 @@
+from __future__ import annotations
+from array import array
+from typing import List, Union
+
+import numpy as np
+from PIL import Image
+from cyclicgentmx.helpers import TILE_TYPECODE
+from cyclicgentmx.tile_atlas import TileImages
+
+# pixels of cells rows gathered and blended at once, it bounds memory of temporary arrays
+BAND_PIXELS = 2**22
+# Image.alpha_composite keeps 7 fraction bits of blending coefficients
+PRECISION_BITS = 7
+# kinds of cells by alpha of their pixels
+EMPTY_CELL = 0
+OPAQUE_CELL = 1
+MASKED_CELL = 2
+TRANSLUCENT_CELL = 3
+
+
+def _div255(values: np.ndarray) -> np.ndarray:
+    return ((values >> 8) + values) >> 8
+
+
+def alpha_composite(destination: np.ndarray, source: np.ndarray, translucent: bool = True) -> None:
+    """Composite RGBA source over destination of the same shape in place with integer rounding of
+    Image.alpha_composite, so results are the same to the bit.
+
+    Opaque pixels are copied as whole 32-bit words, blending of translucent ones is skipped if source
+    has none of them.
+    """
+    source_alpha = source[..., 3]
+    np.copyto(destination.view(np.uint32)[..., 0], source.view(np.uint32)[..., 0], where=source_alpha == 255)
+    if not translucent:
+        return
+    # alpha 0 wraps to 255, so only alpha from 1 to 254 is below 254
+    translucent = source_alpha - np.uint8(1) < 254
+    if not translucent.any():
+        return
+    source_pixels = source[translucent].astype(np.uint32)
+    destination_pixels = destination[translucent].astype(np.uint32)
+    alpha = source_pixels[:, 3]
+    alpha255 = alpha * 255 + destination_pixels[:, 3] * (255 - alpha)
+    source_coefficient = alpha * (255 * 255 << PRECISION_BITS) // alpha255
+    destination_coefficient = (255 << PRECISION_BITS) - source_coefficient
+    result = np.empty_like(source_pixels)
+    result[:, :3] = (source_pixels[:, :3] * source_coefficient[:, None]
+                     + destination_pixels[:, :3] * destination_coefficient[:, None] + (0x80 << PRECISION_BITS))
+    result[:, :3] = _div255(result[:, :3]) >> PRECISION_BITS
+    result[:, 3] = _div255(alpha255 + 0x80)
+    destination[translucent] = result
+
+
+def shared_image(pixels: np.ndarray) -> Image:
+    """RGBA image sharing memory of (height, width, 4) pixels array, pasting into image fills array.
+
+    It is much faster than converting image to array and back with their bytes.
+    """
+    image = Image.frombuffer('RGBA', (pixels.shape[1], pixels.shape[0]), pixels, 'raw', 'RGBA', 0, 1)
+    # image of buffer is copied on first change unless it is marked writable
+    image.readonly = 0
+    return image
+
+
+def tiles_grid(tiles: Union[List[int], array], width: int, rows: range, columns: range) -> np.ndarray:
+    """Gids of cells rectangle of tiles of map "width" as 2D array"""
+    if isinstance(tiles, array):
+        grid = np.frombuffer(tiles, dtype=np.dtype(TILE_TYPECODE)).reshape(-1, width)
+        return grid[rows.start:rows.stop, columns.start:columns.stop].copy()
+    return np.array([tiles[row * width + columns.start:row * width + columns.stop] for row in rows],
+                    dtype=np.dtype(TILE_TYPECODE))
+
+
+class CellArrays:
+    """Tiles as pasted on transparent image, every one in bottom left corner of map cell, stacked in one
+    (N, cell height, cell width, 4) array on first use of their gids, index 0 is empty cell.
+    "kinds" array tells kind of every cell: empty, opaque, with only opaque and transparent pixels or translucent.
+    """
+
+    def __init__(self, tile_images: TileImages, cell_width: int, cell_height: int) -> None:
+        self.tile_images = tile_images
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self._cells = [np.zeros((cell_height, cell_width, 4), dtype=np.uint8)]
+        self._kinds = [EMPTY_CELL]
+        self._indexes = {0: 0}
+        self.array = np.stack(self._cells)
+        self.kinds = np.array(self._kinds, dtype=np.uint8)
+
+    @staticmethod
+    def _kind(cell: np.ndarray) -> int:
+        alpha = cell[..., 3]
+        if not alpha.any():
+            return EMPTY_CELL
+        if (alpha == 255).all():
+            return OPAQUE_CELL
+        if ((alpha == 0) | (alpha == 255)).all():
+            return MASKED_CELL
+        return TRANSLUCENT_CELL
+
+    def indexes(self, gids: List[int]) -> List[int]:
+        """Cell indexes of gids, cells of new gids are stacked once for all of them"""
+        added = False
+        for gid in gids:
+            if gid not in self._indexes:
+                tile = self.tile_images.tile(gid)
+                cell = np.zeros((self.cell_height, self.cell_width, 4), dtype=np.uint8)
+                cell[self.cell_height - tile.height:, :tile.width] = np.asarray(tile.pasted)
+                self._indexes[gid] = len(self._cells)
+                self._cells.append(cell)
+                self._kinds.append(self._kind(cell))
+                added = True
+        if added:
+            self.array = np.stack(self._cells)
+            self.kinds = np.array(self._kinds, dtype=np.uint8)
+        return [self._indexes[gid] for gid in gids]
+
+
+class GridRenderer:
+    """Draws layers of regular grid geometry a band of cells rows at once.
+
+    Target pixels of band are viewed as (rows, columns, cell height, cell width, 4) array, so tiles are copied
+    into it by fancy indexing with cells of gid grid. Opaque tiles are copied whole, tiles with transparent pixels
+    are copied by their alpha mask and translucent ones are blended, each kind by one operation for all its cells.
+    """
+
+    def __init__(self, tile_images: TileImages) -> None:
+        self.tile_images = tile_images
+        self._cell_arrays = dict()
+
+    def _cells(self, cell_width: int, cell_height: int) -> CellArrays:
+        cells = self._cell_arrays.get((cell_width, cell_height))
+        if cells is None:
+            cells = CellArrays(self.tile_images, cell_width, cell_height)
+            self._cell_arrays[(cell_width, cell_height)] = cells
+        return cells
+
+    @staticmethod
+    def _draw_cells(band: np.ndarray, cells: CellArrays, indexes: np.ndarray) -> None:
+        """Draw cells of indexes over band pixels of the same cells grid"""
+        rows, columns = indexes.shape
+        band_cells = band.reshape(rows, cells.cell_height, columns, cells.cell_width, 4).swapaxes(1, 2)
+        kinds = cells.kinds[indexes]
+        cell_rows, cell_columns = np.nonzero(kinds == OPAQUE_CELL)
+        if len(cell_rows):
+            band_cells[cell_rows, cell_columns] = cells.array[indexes[cell_rows, cell_columns]]
+        for kind in (MASKED_CELL, TRANSLUCENT_CELL):
+            cell_rows, cell_columns = np.nonzero(kinds == kind)
+            if not len(cell_rows):
+                continue
+            destination = band_cells[cell_rows, cell_columns]
+            source = cells.array[indexes[cell_rows, cell_columns]]
+            alpha_composite(destination, source, kind == TRANSLUCENT_CELL)
+            band_cells[cell_rows, cell_columns] = destination
+
+    def _draw_band(self, target: np.ndarray, cells: CellArrays, indexes: np.ndarray, x: int, y: int) -> None:
+        """Draw cells of indexes with top left corner at x, y of target, cells out of target are cut"""
+        if not cells.kinds[indexes].any():
+            return
+        height, width = target.shape[:2]
+        band_height = indexes.shape[0] * cells.cell_height
+        band_width = indexes.shape[1] * cells.cell_width
+        left, top = max(x, 0), max(y, 0)
+        right, bottom = min(x + band_width, width), min(y + band_height, height)
+        if left >= right or top >= bottom:
+            return
+        if (left, top, right, bottom) == (x, y, x + band_width, y + band_height):
+            self._draw_cells(target[top:bottom, left:right], cells, indexes)
+            return
+        band = np.zeros((band_height, band_width, 4), dtype=np.uint8)
+        band[top - y:bottom - y, left - x:right - x] = target[top:bottom, left:right]
+        self._draw_cells(band, cells, indexes)
+        target[top:bottom, left:right] = band[top - y:bottom - y, left - x:right - x]
+
+    def draw(self, image: Image, box: tuple, layers_parts: List[List[tuple]], substitution: dict,
+             only_update: bool) -> bool:
+        """Same as MapImage._draw_layers with parts of every layer given as (part, geometry, x, y),
+        x and y are shift of part pixels in map image with layer offset"""
+        x0, y0, x1, y1 = box
+        target = np.empty((image.height, image.width, 4), dtype=np.uint8)
+        target_image = shared_image(target)
+        target_image.paste(image)
+        substitute = bool(substitution)
+        was_changed = False
+        for parts in layers_parts:
+            for part, geometry, partx, party in parts:
+                columns, rows, left, top = geometry.grid(x0 - partx, y0 - party, x1 - partx, y1 - party)
+                if not columns or not rows:
+                    continue
+                cells = self._cells(geometry.tilewidth, geometry.tileheight)
+                band_rows = max(BAND_PIXELS // (len(columns) * cells.cell_width * cells.cell_height), 1)
+                for band_start in range(rows.start, rows.stop, band_rows):
+                    band = range(band_start, min(band_start + band_rows, rows.stop))
+                    gids, inverse = np.unique(tiles_grid(part.tiles, geometry.width, band, columns),
+                                              return_inverse=True)
+                    gids = gids.tolist()
+                    if substitute:
+                        new_gids = [substitution.get(gid) if only_update else substitution.get(gid, gid)
+                                    for gid in gids]
+                        was_changed = was_changed or any(new_gid is not None and new_gid != gid
+                                                         for gid, new_gid in zip(gids, new_gids))
+                        gids = [new_gid or 0 for new_gid in new_gids]
+                    indexes = np.array(cells.indexes(gids))[inverse.reshape(-1)].reshape(len(band), len(columns))
+                    band_top = top + (band_start - rows.start) * cells.cell_height
+                    self._draw_band(target, cells, indexes, left + partx - x0, band_top + party - y0)
+        image.paste(target_image)
+        return was_changed
@@ -0,0 +1,408 @@
+from cyclicgentmx.map_base import MapBase
+from cyclicgentmx.helpers import four_bytes, tiles_from_bytes, indent, iter_tiles_bytes, iter_compressed, \
+    TILE_TYPECODE, ZSTD_FOUND, NUMPY_FOUND
+from cyclicgentmx.tmx_types import Layer, Data
+from cyclicgentmx.image_writer import GifFrameWriter
+from array import array
+import xml.etree.ElementTree as ET
+import base64
+import gzip
+import multiprocessing
+import os
+import pathlib
+import random
+import resource
+import tempfile
+import timeit
+import tracemalloc
+import zlib
+
+
+MEGATILE = 2**20
+DATA_DIR = pathlib.Path(__file__).parent.absolute().joinpath('data')
+
+
+def legacy_tiles_from_bytes(data: bytes) -> list:
+    return list(map(four_bytes, zip(data[::4], data[1::4], data[2::4], data[3::4])))
+
+
+def decode(text: str, compression: str, tiles_decoder) -> list:
+    data = base64.b64decode(text.encode('latin1'))
+    if compression == 'gzip':
+        data = gzip.decompress(data)
+    elif compression == 'zlib':
+        data = zlib.decompress(data)
+    return tiles_decoder(data)
+
+
+def bench_decode(repeat: int = 3) -> None:
+    random.seed(0)
+    tiles = [random.randrange(0, 5000) for _ in range(MEGATILE)]
+    raw = array('I', tiles).tobytes()
+    payloads = {
+        None: raw,
+        'gzip': gzip.compress(raw),
+        'zlib': zlib.compress(raw),
+    }
+    print('base64 decode, seconds per megatile')
+    for compression, payload in payloads.items():
+        text = base64.b64encode(payload).decode('latin1')
+        if decode(text, compression, tiles_from_bytes) != tiles:
+            raise AssertionError('decoded gids differ for compression {}'.format(compression))
+        before = min(timeit.repeat(lambda: decode(text, compression, legacy_tiles_from_bytes),
+                                   number=1, repeat=repeat))
+        after = min(timeit.repeat(lambda: decode(text, compression, tiles_from_bytes), number=1, repeat=repeat))
+        print('  {:<6} before {:.4f}  after {:.4f}  x{:.1f}'.format(str(compression), before, after, before / after))
+    text = base64.b64encode(payloads['zlib']).decode('latin1')
+    peak = peak_memory(lambda: Data.decode_text(text, 'base64', 'zlib'))
+    compact_peak = peak_memory(lambda: Data.decode_text(text, 'base64', 'zlib', compact=True))
+    print('  zlib peak MB of Data.decode_text: list {:.1f}  compact {:.1f}'.format(peak, compact_peak))
+
+
+def synthetic_map(width: int, height: int, layers_count: int, density: float = 0.7) -> MapBase:
+    """test_map.tmx tilesets with random layers of given size"""
+    random.seed(0)
+    m = MapBase.from_file(DATA_DIR.joinpath('test_map.tmx').as_posix())
+    m.width = width
+    m.height = height
+    gids = range(1, sum(tileset.tilecount for tileset in m.tilesets) + 1)
+    m.layers = []
+    for layer_id in range(1, layers_count + 1):
+        tiles = [random.choice(gids) if random.random() < density else 0 for _ in range(width * height)]
+        data = Data('base64', 'zlib', tiles, [], tiles)
+        m.layers.append(Layer(layer_id, 'Tile Layer {}'.format(layer_id), None, None, width, height,
+                              None, True, None, None, None, data, [data]))
+    m.childs = m.tilesets + m.layers
+    return m
+
+
+def bench_render_orthogonal(repeat: int = 3) -> None:
+    for tilewidth in (32, 16):
+        m = synthetic_map(256, 256, 10)
+        m.tilewidth = m.tileheight = tilewidth
+        m._generate_lazy_tileset_images()
+        seconds = min(timeit.repeat(lambda: m._create_map_image_frame(), number=1, repeat=repeat))
+        print('orthogonal 256x256x10 layers, {}px grid: {:.3f} s'.format(tilewidth, seconds))
+
+
+def bench_render_backends(repeat: int = 3) -> None:
+    """PIL paste of every tile against NumPy rows of cells on regular grid, images must be the same"""
+    if not NUMPY_FOUND:
+        print('render backends: NumPy is not installed')
+        return
+    mixed = synthetic_map(256, 256, 10)
+    mixed.tilewidth = mixed.tileheight = 32
+    opaque = synthetic_map(256, 256, 10)
+    tileset = opaque.tilesets[0]
+    opaque.tilesets = [tileset]
+    opaque.tilewidth, opaque.tileheight = tileset.tilewidth, tileset.tileheight
+    gids = range(tileset.firstgid, tileset.firstgid + tileset.tilecount)
+    for layer in opaque.layers:
+        layer.data.tiles[:] = [random.choice(gids) if tile else 0 for tile in layer.data.tiles]
+    print('render backends, orthogonal 256x256x10 layers, seconds')
+    for name, m in (('both tilesets, 32px grid', mixed), ('opaque tileset, 16px grid', opaque)):
+        m._generate_lazy_tileset_images()
+        line = '  {:<26}'.format(name)
+        images = []
+        for backend in ('pil', 'numpy'):
+            m.render_backend = backend
+            seconds = min(timeit.repeat(lambda: m._create_map_image_frame(), number=1, repeat=repeat))
+            images.append(m._create_map_image_frame()[0])
+            line += ' {} {:.3f}'.format(backend, seconds)
+        if images[0].tobytes() != images[1].tobytes():
+            raise AssertionError('NumPy image differs from PIL one')
+        print(line)
+
+
+def bench_render_infinite(repeat: int = 3) -> None:
+    """infinite.tmx composite image of chunks bounds and images of separate chunks"""
+    m = MapBase.from_file(DATA_DIR.joinpath('infinite.tmx').as_posix())
+    m._generate_lazy_tileset_images()
+    chunks = sum(len(layer.data.chunks) for layer in m.layers)
+    composite = min(timeit.repeat(lambda: m._create_map_image_frame(), number=1, repeat=repeat))
+    separate = min(timeit.repeat(lambda: m._create_chunk_images(), number=1, repeat=repeat))
+    print('infinite {} map, {} chunks, {}x{} px: composite {:.3f} s  separate chunks {:.3f} s'.format(
+        m.orientation, chunks, *m._geometry().size, composite, separate))
+
+
+def bench_tile_pyramid(repeat: int = 1) -> None:
+    """Whole map image against pyramid of 256 px tiles drawn without whole map image"""
+    m = synthetic_map(256, 256, 10)
+    m._generate_lazy_tileset_images()
+    whole = min(timeit.repeat(lambda: m._create_map_image_frame(), number=1, repeat=repeat))
+    with tempfile.TemporaryDirectory() as directory:
+        pyramid = min(timeit.repeat(lambda: m.create_tile_pyramid(directory), number=1, repeat=repeat))
+        tiles = sum(len(files) for _, _, files in os.walk(directory))
+    print('orthogonal 256x256x10 layers, {}x{} px: whole image {:.3f} s  pyramid of {} tiles {:.3f} s'.format(
+        *m._geometry().size, whole, tiles, pyramid))
+
+
+def bench_render_region(repeat: int = 3) -> None:
+    """512x512 px view cropped from whole map image against view drawn by render_region"""
+    m = synthetic_map(256, 256, 10)
+    m._generate_lazy_tileset_images()
+    box = (2048, 2048, 2560, 2560)
+    if m.render_region(*box).tobytes() != m._create_map_image_frame()[0].crop(box).tobytes():
+        raise AssertionError('region differs from crop of map image')
+    before = min(timeit.repeat(lambda: m._create_map_image_frame()[0].crop(box), number=1, repeat=repeat))
+    after = min(timeit.repeat(lambda: m.render_region(*box), number=1, repeat=repeat))
+    print('512x512 px view of orthogonal 256x256x10 layers: crop {:.3f} s  region {:.4f} s'.format(before, after))
+
+
+def bench_layer_toggle(repeat: int = 3) -> None:
+    """Map image after change of layer opacity drawn again against composited from cached layer images"""
+    m = synthetic_map(96, 96, 8)
+    m._generate_lazy_tileset_images()
+    layer = m.layers[3]
+
+    def toggle(render) -> None:
+        layer.opacity = 0.5 if layer.opacity is None else None
+        render()
+
+    m.render_image()
+    if m.render_image().tobytes() != m._create_map_image_frame()[0].tobytes():
+        raise AssertionError('composited image differs from drawn one')
+    before = min(timeit.repeat(lambda: toggle(m._create_map_image_frame), number=1, repeat=repeat))
+    after = min(timeit.repeat(lambda: toggle(m.render_image), number=1, repeat=repeat))
+    print('opacity toggle of orthogonal 96x96x8 layers: draw {:.3f} s  composite {:.3f} s'.format(before, after))
+
+
+def bench_animation(repeat: int = 1) -> None:
+    """Incremental dirty region frames against full render of every frame"""
+    m = synthetic_map(64, 64, 4)
+    m._generate_lazy_tileset_images()
+    m._generate_animation_substitutions(max_frames=1000)
+    frames = len(m._animation_events) + 1
+
+    def full_frames() -> None:
+        state = dict(m._animation_start_state)
+        m._create_map_image_frame(state)
+        for substitution_time, changes in m._animation_events:
+            state.update(changes)
+            m._create_map_image_frame(state)
+
+    m.save_image = lambda name, frames, duration=None, delta=False, image_format=None: None
+    animated_cells = m._animated_cells(m._geometry(), m.layers, m._all_animated_tile_gids)
+    animated = sum(len(cells) for cells in animated_cells.values())
+    before = min(timeit.repeat(full_frames, number=1, repeat=repeat))
+    after = min(timeit.repeat(lambda: m.create_animated_image('unused.gif', max_frames=1000), number=1,
+                              repeat=repeat))
+    print('animation 64x64x4 layers, {} frames, {} animated cells: full {:.3f} s  dirty regions {:.3f} s'.format(
+        frames, animated, before, after))
+    processes = os.cpu_count()
+    parallel = min(timeit.repeat(lambda: m.create_animated_image('unused.gif', processes=processes, max_frames=1000),
+                                 number=1, repeat=repeat))
+    print('  whole frames in {} processes {:.3f} s'.format(processes, parallel))
+
+
+def bench_animation_formats(repeat: int = 3) -> None:
+    """Encode time and size of animation frames of test maps as GIF, APNG and lossless WebP"""
+    print('animation formats, seconds and bytes')
+    with tempfile.TemporaryDirectory() as directory:
+        for map_name in ('test_map.tmx', 'test_map_csv.tmx'):
+            m = MapBase.from_file(DATA_DIR.joinpath(map_name).as_posix())
+            frames = [(duration, frame) for frame_time, duration, frame in m.iter_animation_frames()]
+            images = [frame for duration, frame in frames]
+            durations = [duration for duration, frame in frames]
+            line = '  {:<18}'.format(map_name)
+            for image_format in ('gif', 'png', 'webp'):
+                name = os.path.join(directory, 'animation.' + image_format)
+                seconds = min(timeit.repeat(lambda: m.save_image(name, images, durations, delta=True), number=1,
+                                            repeat=repeat))
+                line += ' {} {:.3f} {:>8}'.format(image_format, seconds, os.path.getsize(name))
+            print(line)
+
+
+def peak_rss_growth(function) -> float:
+    """Growth of peak resident memory by function call in forked process in megabytes, it counts image
+    buffers of Pillow unseen by tracemalloc"""
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+
+    def measure() -> None:
+        start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        function()
+        queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start)
+
+    process = context.Process(target=measure)
+    process.start()
+    growth = queue.get()
+    process.join()
+    return growth / 2**10
+
+
+def bench_animation_stream(repeat: int = 1) -> None:
+    """Peak memory of GIF from all frames against GIF written frame by frame"""
+    m = synthetic_map(64, 64, 4)
+    # tiles are loaded before fork, forked processes would share file positions of tileset images
+    for frame in m.iter_animation_frames(max_frames=1000):
+        pass
+    with tempfile.TemporaryDirectory() as directory:
+        name = os.path.join(directory, 'animation.gif')
+        before = peak_rss_growth(lambda: m.create_animated_image(name, max_frames=1000))
+        after = peak_rss_growth(lambda: m.write_animation(GifFrameWriter(name), max_frames=1000))
+        before_time = min(timeit.repeat(lambda: m.create_animated_image(name, max_frames=1000), number=1,
+                                        repeat=repeat))
+        after_time = min(timeit.repeat(lambda: m.write_animation(GifFrameWriter(name), max_frames=1000), number=1,
+                                       repeat=repeat))
+    print('animated GIF 64x64x4 layers: all frames {:.1f} MB {:.3f} s  stream {:.1f} MB {:.3f} s'.format(
+        before, before_time, after, after_time))
+
+
+def bench_gid_index(repeat: int = 3) -> None:
+    """Animated gids lookup by "in" over tiles lists against used gids of every layer, GidIndex on demand"""
+    m = synthetic_map(256, 256, 10, density=0.3)
+    animated = [tile.id + tileset.firstgid for tileset in m.tilesets for tile in tileset.tiles if tile.animation]
+    animated += list(range(10**6, 10**6 + 50))
+
+    def linear() -> list:
+        return [gid for gid in animated if any(gid in layer.data.tiles for layer in m.layers)]
+
+    def used() -> list:
+        used_gids = set()
+        for layer in m.layers:
+            used_gids.update(layer.data.used_gids())
+        return [gid for gid in animated if gid in used_gids]
+
+    if linear() != used():
+        raise AssertionError('used animated gids differ')
+    before = min(timeit.repeat(linear, number=1, repeat=repeat))
+    after = min(timeit.repeat(used, number=1, repeat=repeat))
+    print('used animated gids of {} gids, 256x256x10 layers: scan {:.3f} s  used gids {:.3f} s'.format(
+        len(animated), before, after))
+    data = m.layers[0].data
+    gid = next(iter(data.used_gids()))
+    seconds = min(timeit.repeat(lambda: (data.gid_positions(gid), data.replace_gid(gid, MEGATILE),
+                                         data.replace_gid(MEGATILE, gid)), number=100, repeat=repeat)) / 100
+    print('  positions and replace of gid with {} tiles on index built on demand: {:.6f} s'.format(
+        data.gid_count(gid), seconds))
+
+
+def legacy_save(m: MapBase, map_name: str) -> None:
+    """MapSave.save before streaming writer: whole ElementTree tree, indent, write"""
+    new_file_dir = pathlib.PurePath(map_name).parent
+    root = m.get_root_element()
+    for child in m.childs:
+        root.append(child.get_element(m.file_dir, new_file_dir))
+    indent(root)
+    ET.ElementTree(root).write(map_name, encoding="UTF-8", xml_declaration=True)
+
+
+def big_map(size: int, encoding: str, compression: str = None) -> MapBase:
+    """One layer size x size map, tiles are random gids repeated with period of 2**18 tiles"""
+    m = synthetic_map(1, 1, 0)
+    m.width = m.height = size
+    gids = range(1, sum(tileset.tilecount for tileset in m.tilesets) + 1)
+    period = array(TILE_TYPECODE, (random.choice(gids) for _ in range(2**18)))
+    tiles = period * (size * size // len(period))
+    data = Data(encoding, compression, tiles, [], tiles)
+    m.layers = [Layer(1, 'Tile Layer 1', None, None, size, size, None, True, None, None, None, data, [data])]
+    m.childs = m.tilesets + m.layers
+    return m
+
+
+def mark_modified(m: MapBase) -> MapBase:
+    """Drop kept payloads, so next save encodes every layer"""
+    for layer in m.layers:
+        layer.data.mark_modified()
+    return m
+
+
+def peak_memory(function) -> float:
+    """Peak of memory allocated by function call in megabytes"""
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2**20
+
+
+def bench_save(repeat: int = 3) -> None:
+    maps = [(name, MapBase.from_file(DATA_DIR.joinpath(name).as_posix()))
+            for name in sorted(os.listdir(DATA_DIR.as_posix())) if name.endswith('.tmx')]
+    maps += [('4096x4096 base64 zlib', big_map(4096, 'base64', 'zlib')), ('4096x4096 csv', big_map(4096, 'csv'))]
+    for name, m in maps:
+        # ElementTree output is compressed with default level
+        m.compressionlevel = -1
+    print('save, seconds')
+    with tempfile.TemporaryDirectory() as directory:
+        before_name = os.path.join(directory, 'before.tmx')
+        after_name = os.path.join(directory, 'after.tmx')
+        for name, m in maps:
+            before = min(timeit.repeat(lambda: legacy_save(mark_modified(m), before_name), number=1, repeat=repeat))
+            after = min(timeit.repeat(lambda: mark_modified(m).save(after_name), number=1, repeat=repeat))
+            with open(before_name, 'rb') as before_file, open(after_name, 'rb') as after_file:
+                if before_file.read() != after_file.read():
+                    raise AssertionError('saved {} differs from ElementTree output'.format(name))
+            print('  {:<28} tree {:.4f}  streaming {:.4f}'.format(name, before, after))
+        for name, m in maps[-2:]:
+            before = peak_memory(lambda: legacy_save(mark_modified(m), before_name))
+            after = peak_memory(lambda: mark_modified(m).save(after_name))
+            print('  {:<28} peak MB: tree {:.1f}  streaming {:.1f}'.format(name, before, after))
+
+
+def bench_compression(repeat: int = 3) -> None:
+    """Throughput and ratio of every codec and compressionlevel on map like tiles"""
+    m = big_map(1024, 'base64', 'zlib')
+    tiles = m.layers[0].data.tiles
+    raw_size = len(tiles) * tiles.itemsize
+    codecs = [('zlib', level) for level in (1, 6, 9)] + [('gzip', level) for level in (1, 6, 9)]
+    if ZSTD_FOUND:
+        codecs += [('zstd', level) for level in (1, 3, 9, 19)]
+    print('compression of 1024x1024 tiles, {:.1f} MB raw'.format(raw_size / 2**20))
+    for compression, level in codecs:
+        size = sum(map(len, iter_compressed(iter_tiles_bytes(tiles), compression, level)))
+        seconds = min(timeit.repeat(lambda: sum(map(len, iter_compressed(iter_tiles_bytes(tiles), compression, level))),
+                                    number=1, repeat=repeat))
+        print('  {} level {:<2}  {:7.1f} MB/s  ratio {:.2f}'.format(compression, level, raw_size / 2**20 / seconds,
+                                                                    raw_size / size))
+
+
+def bench_resave(repeat: int = 3) -> None:
+    """Save of loaded map after one tile edit, encoding every layer against reusing unmodified payloads"""
+    m = synthetic_map(1024, 1024, 4)
+    m.compressionlevel = -1
+    with tempfile.TemporaryDirectory() as directory:
+        map_name = os.path.join(directory, 'map.tmx')
+        m.save(map_name)
+        m = MapBase.from_file(map_name)
+        data = m.layers[0].data
+
+        def edit_and_save(all_modified: bool) -> None:
+            data.set_tile(0, data.tiles[0] + 1)
+            if all_modified:
+                mark_modified(m)
+            m.save(map_name)
+
+        before = min(timeit.repeat(lambda: edit_and_save(True), number=1, repeat=repeat))
+        after = min(timeit.repeat(lambda: edit_and_save(False), number=1, repeat=repeat))
+    print('save after one tile edit, 1024x1024x4 layers: all layers {:.3f} s  modified layer {:.3f} s'.format(
+        before, after))
+
+
+def bench_validate(repeat: int = 3) -> None:
+    """Full validation checks every tile, structural one only the map tree"""
+    maps = [('1024x1024x4 layers', synthetic_map(1024, 1024, 4)), ('64x64x200 layers', synthetic_map(64, 64, 200))]
+    print('validate, seconds')
+    for name, m in maps:
+        full = min(timeit.repeat(lambda: m.validate(), number=1, repeat=repeat))
+        structural = min(timeit.repeat(lambda: m.validate(structural=True), number=1, repeat=repeat))
+        print('  {:<20} full {:.4f}  structural {:.4f}'.format(name, full, structural))
+
+
+if __name__ == '__main__':
+    bench_decode()
+    bench_render_orthogonal()
+    bench_render_backends()
+    bench_render_infinite()
+    bench_tile_pyramid()
+    bench_render_region()
+    bench_layer_toggle()
+    bench_animation()
+    bench_animation_stream()
+    bench_animation_formats()
+    bench_gid_index()
+    bench_save()
+    bench_compression()
+    bench_resave()
+    bench_validate()
@@ -1,6 +1,33 @@
 from cyclicgentmx.map_base import MapBase
-from cyclicgentmx.helpers import get_size
+from cyclicgentmx.animation_timeline import AnimationTimeline
+from cyclicgentmx.map_batch import BatchOptions, run_batch, expand_maps
+from cyclicgentmx.map_geometry import GEOMETRIES
+from cyclicgentmx.helpers import get_size, indent, TILE_TYPECODE, NUMPY_FOUND, ZSTD_FOUND
+from cyclicgentmx.image_writer import ApngFrameWriter, FrameWriter, GifFrameWriter, RawFrameWriter, gif_palette, \
+    paletted_frame, clears_pixels, apng_delay, GIF_DURATION_MAX, GIF_TRANSPARENT_INDEX
+from cyclicgentmx.tmx_types import Color, MapError, MapIntValidationError, MapValidationError, Properties, TileSet, \
+    Layer, ObjectGroup, ImageLayer, Group
+from PIL import Image, ImageChops
+from array import array
+from dataclasses import replace
+from types import SimpleNamespace
+import base64
+import copy
+import gzip
+import io
+import multiprocessing
+import os
 import pathlib
+import random
+import struct
+import tempfile
+import xml.etree.ElementTree as ET
+import zlib
+
+
+def same_pixels(image: Image, other: Image) -> bool:
+    """Every band is compared, getbbox of RGBA difference looks only at alpha in Pillow 10+"""
+    return not any(band.getbbox() for band in ImageChops.difference(image, other).split())
 
 
 filenames = ('test_map', 'test_map_csv', 'test_map_base64', 'test_map_base64_gzip', 'test_map_base64_zlib', 'infinite')
@@ -12,6 +39,49 @@ for filename in filenames:
 
 print('Validation test OK')
 
+first_map = MapBase.from_file(pathlib.Path(__file__).parent.absolute().joinpath('data/test_map.tmx').as_posix())
+second_map = MapBase.from_file(pathlib.Path(__file__).parent.absolute().joinpath('data/infinite.tmx').as_posix())
+first_tileset, second_tileset = first_map.tilesets[0], second_map.tilesets[0]
+assert first_tileset.tiles is not second_tileset.tiles and first_tileset.image is not second_tileset.image
+assert first_tileset.childs is not second_tileset.childs
+first_tileset.tiles[0].id += 1
+assert first_tileset.tiles[0].id == second_tileset.tiles[0].id + 1
+
+print('Tileset cache test OK')
+
+
+def data_parts(m: MapBase) -> list:
+    """Encoded data of tile layers, chunks instead of data of infinite map"""
+    return [part for layer in m._tile_layers() if layer.data.encoding
+            for part in (layer.data.chunks or [layer.data])]
+
+
+with tempfile.TemporaryDirectory() as directory:
+    lazy_name = os.path.join(directory, 'lazy.tmx')
+    eager_name = os.path.join(directory, 'eager.tmx')
+    for filename in filenames:
+        test_map = pathlib.Path(__file__).parent.absolute().joinpath('data/{}.tmx'.format(filename)).as_posix()
+        lazy_map = MapBase.from_file(test_map, lazy=True)
+        eager_map = MapBase.from_file(test_map)
+        lazy_map.validate(structural=True)
+        lazy_map.save(lazy_name)
+        assert not any(part.decoded for part in data_parts(lazy_map))
+        assert [part.tiles for part in data_parts(MapBase.from_file(lazy_name))] == \
+               [part.tiles for part in data_parts(eager_map)]
+        # kept payload of lazy map is written again only with unchanged compressionlevel, csv text of file is
+        # always written as it is with its line breaks
+        for m, name in ((lazy_map, lazy_name), (eager_map, eager_name)):
+            m.compressionlevel = -1
+            m.save(name)
+        with open(lazy_name, 'rb') as lazy_file, open(eager_name, 'rb') as eager_file:
+            assert lazy_file.read() == eager_file.read() or filename == 'test_map_csv'
+        lazy_map = MapBase.from_file(test_map, lazy=True)
+        assert [list(part.tiles) for part in data_parts(lazy_map)] == \
+               [list(part.tiles) for part in data_parts(eager_map)]
+        assert all(part.decoded for part in data_parts(lazy_map))
+
+print('Lazy load test OK')
+
 for filename in filenames[1:2]:
     test_map = pathlib.Path(__file__).parent.absolute().joinpath('data/{}.tmx'.format(filename)).as_posix()
     m = MapBase.from_file(test_map)
@@ -19,3 +89,568 @@ for filename in filenames[1:2]:
     m.create_animated_image(m.file_dir.joinpath('map.gif').as_posix())  # temporarily here
 
 print('Save test OK')
+
+with tempfile.TemporaryDirectory() as directory:
+    map_names = [pathlib.Path(__file__).parent.absolute().joinpath('data/{}.tmx'.format(filename)).as_posix()
+                 for filename in filenames]
+    checkpoint = os.path.join(directory, 'checkpoint.jsonl')
+    options = BatchOptions(save_dir=os.path.join(directory, 'maps'))
+    results = list(run_batch(map_names[:3], options, processes=2, checkpoint=checkpoint))
+    assert all(result.ok for result in results) and len(results) == 3
+    results = list(run_batch(map_names, options, processes=2, checkpoint=checkpoint))
+    assert sorted(result.map_name for result in results) == sorted(map_names[3:])
+    other_names = [os.path.join(os.path.dirname(name), '.', os.path.basename(name)) for name in map_names]
+    other_names.append(os.path.relpath(map_names[0]))
+    assert not list(run_batch(other_names, options, processes=2, checkpoint=checkpoint))
+    data_dir = os.path.dirname(map_names[0])
+    assert expand_maps([os.path.join(data_dir, 'test_map_[cx]*.tmx'), 'missing.tmx']) == \
+        [os.path.join(data_dir, 'test_map_csv.tmx'), os.path.join(data_dir, 'test_map_xml.tmx'), 'missing.tmx']
+    missing_map = os.path.join(directory, 'missing.tmx')
+    for attempt in range(2):
+        results = list(run_batch(map_names + [missing_map], options, processes=2, checkpoint=checkpoint))
+        assert [(result.map_name, result.ok) for result in results] == [(missing_map, False)]
+    # worker killed while maps are in flight, they are processed again by new pool
+    options = replace(options, image_dir=os.path.join(directory, 'images'))
+    results = run_batch(map_names * 2, options, processes=1)
+    first = next(results)
+    for process in multiprocessing.active_children():
+        process.kill()
+    results = [first] + list(results)
+    assert len(results) == len(map_names) * 2 and all(result.ok for result in results)
+
+print('Batch test OK')
+
+test_map = pathlib.Path(__file__).parent.absolute().joinpath('data/{}.tmx'.format(filenames[0])).as_posix()
+m = MapBase.from_file(test_map)
+frames = [frame.copy() for frame_time, duration, frame in m.iter_animation_frames()]
+raw = io.BytesIO()
+m.write_animation(RawFrameWriter(raw))
+assert raw.getvalue() == b''.join(frame.tobytes() for frame in frames)
+apng = io.BytesIO()
+m.write_animation(ApngFrameWriter(apng))
+image = Image.open(apng)
+assert image.n_frames == len(frames)
+for number, frame in enumerate(frames):
+    image.seek(number)
+    assert same_pixels(image.convert('RGBA'), frame)
+
+print('Animation stream test OK')
+
+writer_frames = []
+for number, color in enumerate([(255, 0, 0, 255), (0, 255, 0, 255), (0, 0, 255, 255), (0, 0, 0, 0)]):
+    frame = Image.new('RGBA', (8, 8), (255, 255, 0, 255))
+    frame.paste(color, (number, number, number + 4, number + 4))
+    writer_frames.append(frame)
+# longer than 16-bit delays of GIF and APNG in their units
+durations = [100, 250, 70000, 1000000]
+for writer_class, options, expected_durations in (
+        (GifFrameWriter, {'palette_image': gif_palette(writer_frames)}, [100, 250, 70000, GIF_DURATION_MAX]),
+        (ApngFrameWriter, {}, durations)):
+    output = io.BytesIO()
+    with writer_class(output, **options) as writer:
+        for frame, duration in zip(writer_frames, durations):
+            writer.write(frame, duration)
+    image = Image.open(output)
+    assert image.n_frames == len(writer_frames)
+    for number, frame in enumerate(writer_frames):
+        image.seek(number)
+        assert image.info['duration'] == expected_durations[number]
+        assert same_pixels(image.convert('RGBA').convert('RGBa'), frame.convert('RGBa'))
+assert apng_delay(65535) == (65535, 1000) and apng_delay(70000) == (7000, 100) and apng_delay(10**9) == (65535, 1)
+try:
+    FrameWriter(io.BytesIO())
+    raise AssertionError('FrameWriter without write must not be created')
+except TypeError:
+    pass
+
+print('Frame writers test OK')
+
+# animated gid put in place after index of layer tiles was built
+m.layers[-1].data.tiles[0] = 70
+edited = MapBase.from_file(test_map)
+edited.layers[-1].data.tiles[0] = 70
+edited_frames = [(frame_time, frame.copy()) for frame_time, duration, frame in edited.iter_animation_frames()]
+assert len(edited_frames) > len(frames)
+map_frames = [(frame_time, frame.copy()) for frame_time, duration, frame in m.iter_animation_frames()]
+assert len(map_frames) == len(edited_frames)
+for (frame_time, frame), (edited_time, edited_frame) in zip(map_frames, edited_frames):
+    assert frame_time == edited_time and same_pixels(frame, edited_frame)
+    full = m.render_region(0, 0, frame.width, frame.height, time_ms=frame_time)
+    assert same_pixels(full, frame)
+m = MapBase.from_file(test_map)
+
+print('Animated tiles edit test OK')
+
+with tempfile.TemporaryDirectory() as directory:
+    for image_format in ('png', 'webp'):
+        name = os.path.join(directory, 'map.' + image_format)
+        m.create_animated_image(name)
+        image = Image.open(name)
+        assert image.n_frames == len(frames)
+        for number, frame in enumerate(frames):
+            image.seek(number)
+            assert same_pixels(image.convert('RGBA').convert('RGBa'), frame.convert('RGBa'))
+
+print('Image formats test OK')
+
+frame_times = [frame_time for frame_time, duration, frame in m.iter_animation_frames()]
+rendered = [m.render_image(time_ms=frame_time) for frame_time in frame_times]
+palette_image = gif_palette(frames)
+assert not clears_pixels([paletted_frame(frame, palette_image) for frame in frames])
+with tempfile.TemporaryDirectory() as directory:
+    name = os.path.join(directory, 'map.gif')
+    m.create_animated_image(name, delta=True)
+    streamed = io.BytesIO()
+    m.write_animation(GifFrameWriter(streamed, palette_image))
+    for image in (Image.open(name), Image.open(streamed)):
+        assert image.n_frames == len(frame_times)
+        for number, frame in enumerate(rendered):
+            image.seek(number)
+            expected = paletted_frame(frame, palette_image)
+            expected.info['transparency'] = GIF_TRANSPARENT_INDEX
+            expected = expected.convert('RGBA')
+            assert same_pixels(image.convert('RGBA').convert('RGBa'), expected.convert('RGBa'))
+
+print('Delta GIF test OK')
+
+m = MapBase.from_file(test_map)
+layer = m.layers[-1]
+layer.opacity = 0.5
+layer.tintcolor = Color('#ff8040')
+image = m.render_image()
+assert image.tobytes() == m._create_map_image_frame()[0].tobytes()
+misses = m._layer_images.misses
+layer.visible = False
+assert m.render_image().tobytes() == m.render_image([other.name for other in m.layers[:-1]]).tobytes()
+layer.visible = True
+assert m.render_image().tobytes() == image.tobytes()
+assert m._layer_images.misses == misses
+layer.data.set_tile(0, 2 if layer.data.tiles[0] == 1 else 1)
+assert m.render_image().tobytes() == m._create_map_image_frame()[0].tobytes()
+assert m._layer_images.misses == misses + 1
+layer.data.tiles[0] = 2 if layer.data.tiles[0] == 1 else 1
+assert m.render_image().tobytes() == m._create_map_image_frame()[0].tobytes()
+assert m._layer_images.misses == misses + 2
+layers = m.layers
+m.layers = [replace(layers[number % len(layers)], name='Layer {}'.format(number), offsetx=number)
+            for number in range(20)]
+m.childs = m.tilesets + m.layers
+m.render_image()
+misses = m._layer_images.misses
+m.render_image()
+assert m._layer_images.misses == misses
+
+print('Layer images test OK')
+
+# Castle tiles are 32x32 on 16x16 grid, so tiles drawn later cover part of tiles drawn before them
+random.seed(0)
+cells_orders = {'right-down': [0, 1, 2, 3, 4, 5, 6, 7, 8], 'right-up': [6, 7, 8, 3, 4, 5, 0, 1, 2],
+                'left-down': [2, 1, 0, 5, 4, 3, 8, 7, 6], 'left-up': [8, 7, 6, 5, 4, 3, 2, 1, 0]}
+for renderorder, cells_order in cells_orders.items():
+    m = MapBase.from_file(test_map)
+    m.width = m.height = 3
+    m.renderorder = renderorder
+    m.layers = m.layers[:2]
+    m.childs = m.tilesets + m.layers
+    m._generate_lazy_tileset_images()
+    castle = m.tilesets[1]
+    opaque_gids = [gid for gid in range(castle.firstgid, castle.firstgid + castle.tilecount)
+                   if m._lazy_tileset_images.tile(gid).mask.getextrema() == (255, 255)]
+    for number, layer in enumerate(m.layers):
+        layer.width = layer.height = 3
+        layer.offsetx = layer.offsety = None
+        # upper layer has three overlapping tiles at bottom left, so order of lower layer is seen around them
+        layer.data.tiles = layer.data.childs = [random.choice(opaque_gids) if number == 0 or index in (4, 6, 7) else 0
+                                                for index in range(9)]
+    geometry = m._geometry()
+    assert [index for index, x, y in geometry.cells(0, 0, *geometry.size)] == cells_order
+    expected = Image.new('RGBA', geometry.size)
+    # every layer is drawn in the same order, left-up layers were flipped every other layer before
+    for layer in m.layers:
+        layer_image = Image.new('RGBA', geometry.size)
+        for index in cells_order:
+            if not layer.data.tiles[index]:
+                continue
+            tile = m._lazy_tileset_images.tile(layer.data.tiles[index]).image
+            layer_image.paste(tile, (index % 3 * 16, (index // 3 + 1) * 16 - tile.height), tile)
+        expected.alpha_composite(layer_image)
+    assert same_pixels(m.render_image(), expected) and same_pixels(m._create_map_image_frame()[0], expected)
+
+print('Render order test OK')
+
+# tiles of 24x20 are bigger than every grid cell, so they overlap cells around their own
+random.seed(0)
+geometry_maps = [('orthogonal', {}), ('orthogonal', {'renderorder': 'left-up'}), ('isometric', {}),
+                 ('staggered', {}), ('staggered', {'staggeraxis': 'x', 'staggerindex': 'even'}),
+                 ('hexagonal', {'hexsidelength': 6}),
+                 ('hexagonal', {'hexsidelength': 6, 'staggeraxis': 'x', 'staggerindex': 'even'})]
+for orientation, fields in geometry_maps:
+    fields = dict(dict(width=7, height=5, tilewidth=16, tileheight=8, renderorder='right-down', hexsidelength=None,
+                       staggeraxis='y', staggerindex='odd', tilesets=[SimpleNamespace(tilewidth=24, tileheight=20)]),
+                  **fields)
+    geometry = GEOMETRIES[orientation](SimpleNamespace(orientation=orientation, **fields))
+    size_x, size_y = geometry.size
+    anchors = {index: (x, y) for index, x, y in geometry.cells(-100, -100, size_x + 100, size_y + 100)}
+    assert sorted(anchors) == list(range(7 * 5))
+    assert all(anchors[j * 7 + i] == geometry.anchor(i, j) for i in range(7) for j in range(5))
+    # every tile box intersecting box is yielded, some more cells may be yielded
+    boxes = [(0, 0, 1, 1), (size_x - 3, size_y - 3, size_x, size_y)]
+    for _ in range(200):
+        x, y = random.randrange(-30, size_x + 30), random.randrange(-30, size_y + 30)
+        boxes.append((x, y, x + random.randrange(1, 20), y + random.randrange(1, 20)))
+    for box in boxes:
+        found = {index for index, x, y in geometry.cells(*box)}
+        for i in range(7):
+            for j in range(5):
+                x0, y0, x1, y1 = geometry.tile_box(i, j, 24, 20)
+                if x0 < box[2] and box[0] < x1 and y0 < box[3] and box[1] < y1:
+                    assert j * 7 + i in found, (orientation, fields, box, i, j)
+    x0, y0, x1, y1 = geometry.cells_box(2, 1, 5, 4)
+    for i in range(2, 5):
+        for j in range(1, 4):
+            box = geometry.tile_box(i, j, 24, 20)
+            assert x0 <= box[0] and y0 <= box[1] and box[2] <= x1 and box[3] <= y1
+    sub, shiftx, shifty = geometry.sub_geometry(2, 1, 3, 3)
+    assert all((x + shiftx, y + shifty) == geometry.anchor(i + 2, j + 1)
+               for i in range(3) for j in range(3) for x, y in [sub.anchor(i, j)])
+
+print('Geometry test OK')
+
+zlib_map = pathlib.Path(__file__).parent.absolute().joinpath('data/test_map_base64_zlib.tmx').as_posix()
+with tempfile.TemporaryDirectory() as directory:
+    name = os.path.join(directory, 'map.tmx')
+    for options in ({}, {'lazy': True}, {'compact': True}):
+        m = MapBase.from_file(zlib_map, **options)
+        m.save(name)
+        tiles = m.layers[0].data.tiles
+        tiles[5] = 1 if tiles[5] != 1 else 2
+        m.save(name)
+        assert MapBase.from_file(name).layers[0].data.tiles[5] == tiles[5]
+    assert MapBase.from_file(zlib_map, compact=True).layers[0].data.modified
+    texts = dict()
+    for level in (1, 9):
+        for lazy in (False, True):
+            m = MapBase.from_file(zlib_map, lazy=lazy)
+            m.compressionlevel = level
+            m.save(name)
+            with open(name, encoding='utf-8') as map_file:
+                texts[level, lazy] = map_file.read()
+    assert texts[1, False] == texts[1, True] and texts[9, False] == texts[9, True]
+    assert texts[9, True].replace('compressionlevel="9"', 'compressionlevel="1"') != texts[1, True]
+    data = MapBase.from_file(zlib_map).layers[0].data
+    tiles = list(data.tiles)
+    data.tiles = data.childs = tiles
+    assert data.tiles is tiles and data.childs is tiles
+    count = data.gid_count(3)
+    tiles[tiles.index(0) if 0 in tiles else tiles.index(1)] = 3
+    data.mark_modified()
+    assert data.gid_count(3) == count + 1
+
+print('Payload test OK')
+
+with tempfile.TemporaryDirectory() as directory:
+    name = os.path.join(directory, 'map.tmx')
+
+    def saved_data_texts(m: MapBase) -> list:
+        m.save(name)
+        return [data.text for data in ET.parse(name).iter('data')]
+
+    m = MapBase.from_file(zlib_map)
+    m.compressionlevel = 0
+    stored = saved_data_texts(m)
+    m.compressionlevel = 9
+    best = saved_data_texts(m)
+    assert stored != best
+    m.compressionlevel = 0
+    m.layers[0].data.compressionlevel = 9
+    assert saved_data_texts(m)[0] == best[0]
+    m.layers[0].data.compressionlevel = None
+    for layer in m._tile_layers():
+        layer.data.compression = 'zstd'
+    m.compressionlevel = 22
+    m.validate()
+    m.layers[0].data.compression = 'zlib'
+    try:
+        m.validate()
+    except MapIntValidationError:
+        pass
+    else:
+        raise AssertionError('compressionlevel 22 of map with zlib layer is valid')
+
+print('Compression level test OK')
+
+xml_map = MapBase.from_file(pathlib.Path(__file__).parent.absolute().joinpath('data/test_map_xml.tmx').as_posix())
+for filename in ('test_map_base64', 'test_map_base64_gzip', 'test_map_base64_zlib'):
+    test_map = pathlib.Path(__file__).parent.absolute().joinpath('data/{}.tmx'.format(filename)).as_posix()
+    m = MapBase.from_file(test_map)
+    assert [list(part.tiles) for part in data_parts(m)] == [list(layer.data.tiles) for layer in xml_map._tile_layers()]
+    for part, data in zip(data_parts(m), ET.parse(test_map).iter('data')):
+        payload = base64.b64decode(data.text.strip())
+        if data.get('compression') == 'gzip':
+            payload = gzip.decompress(payload)
+        elif data.get('compression') == 'zlib':
+            payload = zlib.decompress(payload)
+        assert list(part.tiles) == list(struct.unpack('<{}I'.format(len(payload) // 4), payload))
+
+print('Decode test OK')
+
+with tempfile.TemporaryDirectory() as directory:
+    compact_name = os.path.join(directory, 'compact.tmx')
+    eager_name = os.path.join(directory, 'eager.tmx')
+    for filename in filenames:
+        test_map = pathlib.Path(__file__).parent.absolute().joinpath('data/{}.tmx'.format(filename)).as_posix()
+        compact_map = MapBase.from_file(test_map, compact=True)
+        eager_map = MapBase.from_file(test_map)
+        compact_parts = [part for layer in compact_map._tile_layers()
+                         for part in (layer.data.chunks or [layer.data])]
+        eager_parts = [part for layer in eager_map._tile_layers() for part in (layer.data.chunks or [layer.data])]
+        assert all(isinstance(part.tiles, array) and part.tiles.typecode == TILE_TYPECODE for part in compact_parts)
+        assert [list(part.tiles) for part in compact_parts] == [list(part.tiles) for part in eager_parts]
+        compact_map.validate()
+        compact_map.save(compact_name)
+        eager_map.save(eager_name)
+        with open(compact_name, 'rb') as compact_file, open(eager_name, 'rb') as eager_file:
+            assert compact_file.read() == eager_file.read()
+
+print('Compact tiles test OK')
+
+child_tags = {Properties: 'properties', TileSet: 'tileset', Layer: 'layer', ObjectGroup: 'objectgroup',
+              ImageLayer: 'imagelayer', Group: 'group'}
+for filename in filenames:
+    test_map = pathlib.Path(__file__).parent.absolute().joinpath('data/{}.tmx'.format(filename)).as_posix()
+    m = MapBase.from_file(test_map)
+    root = ET.parse(test_map).getroot()
+    elements = [child for child in root if child.tag in child_tags.values()]
+    assert [child_tags[type(child)] for child in m.childs] == [element.tag for element in elements]
+    assert [child.name for child in m.childs if isinstance(child, (Layer, ObjectGroup, ImageLayer, Group))] == \
+           [element.get('name') for element in elements if element.tag not in ('properties', 'tileset')]
+    assert (m.width, m.height, m.nextlayerid, m.nextobjectid, m.infinite) == \
+           (int(root.get('width')), int(root.get('height')), int(root.get('nextlayerid')),
+            int(root.get('nextobjectid')), root.get('infinite') == '1')
+
+print('Streaming load test OK')
+
+first_map = MapBase.from_file(pathlib.Path(__file__).parent.absolute().joinpath('data/test_map.tmx').as_posix())
+second_map = MapBase.from_file(pathlib.Path(__file__).parent.absolute().joinpath('data/infinite.tmx').as_posix())
+first_map._generate_lazy_tileset_images()
+second_map._generate_lazy_tileset_images()
+assert first_map._lazy_tileset_images.tile(1) is second_map._lazy_tileset_images.tile(1)
+for tileset in first_map.tilesets:
+    source = Image.open(first_map.file_dir.joinpath(tileset.image.source).as_posix()).convert('RGBA')
+    margin = tileset.margin or 0
+    spacing = tileset.spacing or 0
+    for tile_id in (0, tileset.columns + 1, tileset.tilecount - 1):
+        row, column = divmod(tile_id, tileset.columns)
+        left = margin + (spacing + tileset.tilewidth) * column
+        top = margin + (spacing + tileset.tileheight) * row
+        expected = source.crop((left, top, left + tileset.tilewidth, top + tileset.tileheight))
+        assert first_map._lazy_tileset_images[tileset.firstgid + tile_id].tobytes() == expected.tobytes()
+try:
+    first_map._lazy_tileset_images.tile(sum(tileset.tilecount for tileset in first_map.tilesets) + 1)
+except IndexError:
+    pass
+else:
+    raise AssertionError('gid out of tilesets has tile image')
+
+print('Tileset images test OK')
+
+formats = [('csv', None), ('base64', None), ('base64', 'gzip'), ('base64', 'zlib')]
+if ZSTD_FOUND:
+    formats.append(('base64', 'zstd'))
+with tempfile.TemporaryDirectory() as directory:
+    name = os.path.join(directory, 'map.tmx')
+    tree_name = os.path.join(directory, 'tree.tmx')
+    for encoding, compression in formats:
+        m = MapBase.from_file(pathlib.Path(__file__).parent.absolute().joinpath('data/test_map_xml.tmx').as_posix())
+        for layer in m._tile_layers():
+            layer.data.encoding = encoding
+            layer.data.compression = compression
+            layer.data.mark_modified()
+        # get_element compresses with default level
+        m.compressionlevel = -1
+        m.save(name)
+        root = m.get_root_element()
+        for child in m.childs:
+            root.append(child.get_element(m.file_dir, pathlib.PurePath(tree_name).parent))
+        indent(root)
+        ET.ElementTree(root).write(tree_name, encoding='UTF-8', xml_declaration=True)
+        with open(name, 'rb') as map_file, open(tree_name, 'rb') as tree_file:
+            assert map_file.read() == tree_file.read()
+        assert [list(part.tiles) for part in data_parts(MapBase.from_file(name))] == \
+               [list(layer.data.tiles) for layer in xml_map._tile_layers()]
+        for data, layer in zip(ET.parse(name).iter('data'), xml_map._tile_layers()):
+            if encoding == 'csv':
+                assert list(map(int, data.text.split(','))) == list(layer.data.tiles)
+            elif compression != 'zstd':
+                payload = base64.b64decode(data.text)
+                payload = {'gzip': gzip.decompress, 'zlib': zlib.decompress}.get(compression, bytes)(payload)
+                assert struct.pack('<{}I'.format(len(layer.data.tiles)), *layer.data.tiles) == payload
+
+print('Encode test OK')
+
+
+def raises_validation_error(function) -> bool:
+    try:
+        function()
+    except MapValidationError:
+        return True
+    return False
+
+
+m = MapBase.from_file(pathlib.Path(__file__).parent.absolute().joinpath('data/test_map_xml.tmx').as_posix())
+m.validate()
+m.layers[0].data.tiles[3] = '5'
+assert raises_validation_error(m.validate) and not raises_validation_error(lambda: m.validate(structural=True))
+m.layers[0].data.tiles[3] = 5
+m.childs[m.childs.index(m.layers[0])] = copy.copy(m.layers[0])
+assert raises_validation_error(m.validate)
+m = MapBase.from_file(pathlib.Path(__file__).parent.absolute().joinpath('data/infinite.tmx').as_posix())
+data = m.layers[0].data
+data.childs = list(data.chunks)
+m.validate()
+data.childs = [copy.copy(chunk) for chunk in data.chunks]
+assert raises_validation_error(m.validate)
+
+print('Validation errors test OK')
+
+# infinite map is drawn like finite map of its chunks bounds with tiles of chunks
+infinite_map = pathlib.Path(__file__).parent.absolute().joinpath('data/infinite.tmx').as_posix()
+m = MapBase.from_file(infinite_map)
+finite = MapBase.from_file(infinite_map)
+x0, y0, width, height = finite._chunks_bounds()
+for layer in finite._tile_layers():
+    tiles = [0] * (width * height)
+    for chunk in layer.data.chunks:
+        for j in range(chunk.height):
+            start = (chunk.y - y0 + j) * width + chunk.x - x0
+            tiles[start:start + chunk.width] = chunk.tiles[j * chunk.width:(j + 1) * chunk.width]
+    layer.data.chunks = []
+    layer.data.tiles = layer.data.childs = tiles
+    layer.width, layer.height = width, height
+finite.infinite = False
+finite.width, finite.height = width, height
+finite.validate()
+m._generate_lazy_tileset_images()
+finite._generate_lazy_tileset_images()
+assert same_pixels(m._create_map_image_frame()[0], finite._create_map_image_frame()[0])
+chunk_images = m._create_chunk_images()
+assert chunk_images.keys() == {(chunk.x, chunk.y) for layer in m._tile_layers() for chunk in layer.data.chunks}
+
+print('Infinite map test OK')
+
+m = MapBase.from_file(pathlib.Path(__file__).parent.absolute().joinpath('data/test_map.tmx').as_posix())
+image = m.render_image()
+tile_size = 256
+with tempfile.TemporaryDirectory() as directory:
+    max_zoom = m.create_tile_pyramid(directory, tile_size)
+    assert tile_size << max_zoom >= max(image.size) > tile_size << max_zoom - 1
+    saved = 0
+    for x in range(-(-image.width // tile_size)):
+        for y in range(-(-image.height // tile_size)):
+            expected = image.crop((x * tile_size, y * tile_size, (x + 1) * tile_size, (y + 1) * tile_size))
+            name = os.path.join(directory, str(max_zoom), str(x), '{}.png'.format(y))
+            if not expected.getbbox():
+                assert not os.path.exists(name)
+                continue
+            saved += 1
+            assert same_pixels(Image.open(name).convert('RGBA'), expected)
+    assert saved == sum(len(files) for files in (os.listdir(os.path.join(directory, str(max_zoom), column))
+                                                 for column in os.listdir(os.path.join(directory, str(max_zoom)))))
+    assert Image.open(os.path.join(directory, '0', '0', '0.png')).size == (tile_size, tile_size)
+
+print('Tile pyramid test OK')
+
+m = MapBase.from_file(pathlib.Path(__file__).parent.absolute().joinpath('data/test_map.tmx').as_posix())
+image = m.render_image()
+for box in ((100, 200, 612, 456), (-50, -20, 300, 100), (1500, 1500, 1700, 1650)):
+    expected = image.crop(box)
+    assert same_pixels(m.render_region(*box), expected)
+cells_box = m._geometry().cells_box(3, 4, 10, 8)
+assert m.render_region(3, 4, 10, 8, cells=True).tobytes() == m.render_region(*cells_box).tobytes()
+state = m.render_region(0, 0, *image.size, time_ms=0)
+assert same_pixels(state, next(m.iter_animation_frames())[2])
+try:
+    m.render_region(10, 10, 10, 20)
+except MapError:
+    pass
+else:
+    raise AssertionError('empty region is rendered')
+
+print('Render region test OK')
+
+m = MapBase.from_file(pathlib.Path(__file__).parent.absolute().joinpath('data/test_map.tmx').as_posix())
+with tempfile.TemporaryDirectory() as directory:
+    images = []
+    for processes in (None, 2):
+        name = os.path.join(directory, 'map_{}.png'.format(processes))
+        m.create_animated_image(name, processes=processes)
+        images.append(Image.open(name))
+    assert images[0].n_frames == images[1].n_frames > 1
+    for number in range(images[0].n_frames):
+        images[0].seek(number)
+        images[1].seek(number)
+        assert images[0].info['duration'] == images[1].info['duration']
+        assert same_pixels(images[0].convert('RGBA'), images[1].convert('RGBA'))
+
+print('Frames in processes test OK')
+
+m = MapBase.from_file(pathlib.Path(__file__).parent.absolute().joinpath('data/test_map.tmx').as_posix())
+naive = dict()
+for tileset in m.tilesets:
+    for tile in tileset.tiles:
+        if tile.animation:
+            naive[tile.id + tileset.firstgid] = [(frame.tileid + tileset.firstgid, frame.duration)
+                                                 for frame in tile.animation.childs]
+
+
+def naive_state(time: int) -> dict:
+    """Gid shown by every animation at time, found by walking its frames"""
+    state = dict()
+    for gid, frames in naive.items():
+        time_in_cycle = time % sum(duration for frame_gid, duration in frames)
+        for frame_gid, duration in frames:
+            if time_in_cycle < duration:
+                state[gid] = frame_gid
+                break
+            time_in_cycle -= duration
+    return state
+
+
+timeline = AnimationTimeline.from_tilesets(m.tilesets)
+events = dict(timeline.events())
+previous = naive_state(0)
+assert timeline.state_at(0) == previous
+for time in range(1, timeline.period):
+    state = naive_state(time)
+    changes = {gid: new_gid for gid, new_gid in state.items() if previous[gid] != new_gid}
+    assert events.pop(time, dict()) == changes
+    previous = state
+assert not events and naive_state(timeline.period) == timeline.state_at(timeline.period) == timeline.state_at(0)
+for time in (0, 700, 5555, timeline.period - 1):
+    assert timeline.state_at(time) == naive_state(time)
+quantized = AnimationTimeline.from_tilesets(m.tilesets, quantum=1000)
+start_state, quantized_events, cycle_time = quantized.frames(5)
+assert len(quantized_events) == 4 and all(time % 1000 == 0 for time, changes in quantized_events)
+assert timeline.frames(5) is None
+
+print('Animation timeline test OK')
+
+if NUMPY_FOUND:
+    for filename in ('test_map', 'test_map_csv', 'test_map_xml'):
+        m = MapBase.from_file(pathlib.Path(__file__).parent.absolute().joinpath('data/{}.tmx'.format(filename))
+                              .as_posix())
+        m._generate_lazy_tileset_images()
+        m.layers[0].opacity = 0.5
+        m.layers[-1].tintcolor = Color('#ff8040')
+        state = AnimationTimeline.from_tilesets(m.tilesets).state_at(700)
+        images = []
+        for backend in ('pil', 'numpy'):
+            m.render_backend = backend
+            m._layer_images = None
+            images.append((m._create_map_image_frame()[0], m._create_map_image_frame(state)[0], m.render_image(),
+                           m.render_region(5, 7, 300, 200)))
+        assert m._numpy_backend(m._geometry()) or filename == 'test_map'
+        for pil_image, numpy_image in zip(*images):
+            assert pil_image.tobytes() == numpy_image.tobytes()
+
+print('NumPy backend test OK')
@@ -0,0 +1,110 @@
+from __future__ import annotations
+from bisect import bisect_right
+from typing import List, Tuple
+import os
+
+from PIL import Image
+from cyclicgentmx.helpers import LRUCache
+
+
+class TileImage:
+    """Tile image with its alpha mask ready for Image.paste.
+
+    "core" and "mask_core" are loaded Pillow core images, they let hot loops paste without Image.paste
+    argument checks.
+    """
+    __slots__ = ('image', 'mask', 'core', 'mask_core', 'width', 'height', 'translucent', '_pasted')
+
+    def __init__(self, image: Image) -> None:
+        self.image = image
+        self.mask = image.getchannel('A')
+        image.load()
+        self.mask.load()
+        self.core = image.im
+        self.mask_core = self.mask.im
+        self.width, self.height = image.size
+        self.translucent = any(self.mask.histogram()[1:255])
+        self._pasted = None
+
+    @property
+    def pasted(self) -> Image:
+        """Tile as it looks after pasting with its own mask on transparent image"""
+        if self._pasted is None:
+            self._pasted = Image.new('RGBA', self.image.size)
+            self._pasted.paste(self.image, (0, 0), self.mask)
+            self._pasted.load()
+        return self._pasted
+
+    def composite(self, core, x: int, y: int) -> None:
+        """Alpha composite pasted tile over core image region, same as Image.alpha_composite of layer"""
+        box = (x, y, x + self.width, y + self.height)
+        core.paste(Image.core.alpha_composite(core.crop(box), self.pasted.im), box)
+
+
+class TileAtlas:
+    """Tileset image sliced into tiles on first use of every tile"""
+    def __init__(self, source: str, tilewidth: int, tileheight: int, margin: int, spacing: int,
+                 columns: int, tilecount: int) -> None:
+        image = Image.open(source)
+        if image.mode != 'RGBA':
+            image = image.convert(mode='RGBA')
+        self.image = image
+        self.tilewidth = tilewidth
+        self.tileheight = tileheight
+        self.margin = margin
+        self.spacing = spacing
+        self.columns = columns
+        self.tilecount = tilecount // columns * columns
+        self._tiles = [None] * self.tilecount
+
+    def __len__(self) -> int:
+        return self.tilecount
+
+    def __getitem__(self, tile_id: int) -> Image:
+        return self.tile(tile_id).image
+
+    def tile(self, tile_id: int) -> TileImage:
+        tile = self._tiles[tile_id]
+        if tile is None:
+            row, column = divmod(tile_id, self.columns)
+            left = self.margin + (self.spacing + self.tilewidth) * column
+            top = self.margin + (self.spacing + self.tileheight) * row
+            tile = TileImage(self.image.crop((left, top, left + self.tilewidth, top + self.tileheight)))
+            self._tiles[tile_id] = tile
+        return tile
+
+    @classmethod
+    def from_tileset(cls, source: str, tileset) -> TileAtlas:
+        source = os.path.realpath(source)
+        stat = os.stat(source)
+        margin = tileset.margin if tileset.margin else 0
+        spacing = tileset.spacing if tileset.spacing else 0
+        geometry = (tileset.tilewidth, tileset.tileheight, margin, spacing, tileset.columns, tileset.tilecount)
+        key = (source, stat.st_mtime_ns, stat.st_size) + geometry
+        return TILE_ATLAS_CACHE.get(key, lambda: cls(source, *geometry))
+
+
+class TileImages:
+    """Tile images of a map by gid, gid 0 is empty tile"""
+    def __init__(self, atlases: List[Tuple[int, TileAtlas]]) -> None:
+        atlases = sorted(atlases, key=lambda item: item[0])
+        self._firstgids = [firstgid for firstgid, atlas in atlases]
+        self._atlases = [atlas for firstgid, atlas in atlases]
+        self._tiles = {0: None}
+
+    def __getitem__(self, gid: int) -> Image:
+        tile = self.tile(gid)
+        return tile.image if tile else None
+
+    def tile(self, gid: int) -> TileImage:
+        tile = self._tiles.get(gid)
+        if tile is None and gid not in self._tiles:
+            index = bisect_right(self._firstgids, gid) - 1
+            if index < 0 or gid - self._firstgids[index] >= len(self._atlases[index]):
+                raise IndexError('gid {} is not in map tilesets'.format(gid))
+            tile = self._atlases[index].tile(gid - self._firstgids[index])
+            self._tiles[gid] = tile
+        return tile
+
+
+TILE_ATLAS_CACHE = LRUCache(maxsize=32)
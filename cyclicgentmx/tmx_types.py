@@ -1,15 +1,23 @@
 from __future__ import annotations
 import os
-from typing import Any, List, Union, Optional
+from typing import Any, Iterable, Iterator, List, Union, Optional
+from array import array
 from dataclasses import dataclass
-from itertools import chain
+from functools import partial
 import pathlib
 import base64
 import gzip
 import zlib
 import xml.etree.ElementTree as ET
-from cyclicgentmx.helpers import count_types, int_or_none, float_or_none, four_bytes, clear_dict_from_none, \
-    get_four_bytes
+from cyclicgentmx.tmx_writer import TmxWriter
+from cyclicgentmx.helpers import count_types, int_or_none, float_or_none, clear_dict_from_none, \
+    tiles_from_bytes, make_tiles, valid_tiles, same_items, LRUCache, GidIndex, gids_positions, iter_tiles_bytes, \
+    iter_compressed, iter_base64, zstd_decompress, tiles_digest, TILES_PIECE_SIZE, MAX_COMPRESSION_LEVELS
+
+# Longest encoded text of tiles kept as payload for next save
+PAYLOAD_MAX_SIZE = 2**24
+# Parsed roots of external tileset files shared by all maps
+TILESET_CACHE = LRUCache(maxsize=64)
 
 
 class Color:
@@ -120,20 +128,211 @@ class Grid:
 
 
 @dataclass
-class Chunk:
+class EncodedTiles:
+    text: str
+    encoding: str
+    compression: Optional[str]
+    compact: bool
+    # compressionlevel of data or of map the text was written with, as it was set, loaded text has map one
+    compressionlevel: Optional[int] = None
+    # tiles_digest of decoded tiles the text was written from, None for text which was never decoded
+    digest: Optional[bytes] = None
+
+    def decode(self) -> List[int]:
+        return Data.decode_text(self.text, self.encoding, self.compression, self.compact)
+
+    def is_encoded_as(self, encoding: Optional[str], compression: Optional[str],
+                      compressionlevel: Optional[int] = None) -> bool:
+        if self.encoding != encoding:
+            return False
+        if encoding != 'base64':
+            return True
+        if self.compression != compression:
+            return False
+        # None and -1 are both default level
+        levels = [-1 if level is None else level for level in (self.compressionlevel, compressionlevel)]
+        return compression is None or levels[0] == levels[1]
+
+
+class LazyTiles:
+    """Keeps "tiles" as encoded text and decodes it on first access.
+
+    Encoded text of lazy "tiles" stays as payload of unmodified "tiles" and save writes it instead of encoding
+    "tiles" again, payload written by save is kept too. "tiles" is plain list or array, so payload of decoded
+    "tiles" keeps their digest and it is used only while "tiles" still have this digest.
+    """
+    LAZY_FIELDS = ('tiles',)
+
+    @classmethod
+    def from_encoded(cls, encoded: EncodedTiles, **fields: Any) -> LazyTiles:
+        self = cls.__new__(cls)
+        self.__dict__.update(fields)
+        self.__dict__['encoded_tiles'] = encoded
+        return self
+
+    @property
+    def decoded(self) -> bool:
+        return 'encoded_tiles' not in self.__dict__
+
+    def __getattr__(self, name: str) -> Any:
+        encoded = self.__dict__.get('encoded_tiles')
+        if encoded is None or name not in self.LAZY_FIELDS:
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+        tiles = encoded.decode()
+        for field in self.LAZY_FIELDS:
+            self.__dict__[field] = tiles
+        encoded.digest = tiles_digest(tiles)
+        self.__dict__['_payload'] = self.__dict__.pop('encoded_tiles')
+        return tiles
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in self.LAZY_FIELDS:
+            if 'encoded_tiles' in self.__dict__:
+                getattr(self, name)
+            self.__dict__.pop('_payload', None)
+        super().__setattr__(name, value)
+
+    @property
+    def modified(self) -> bool:
+        """True when there is no encoded payload of "tiles" to reuse"""
+        return self._valid_payload() is None
+
+    def mark_modified(self) -> None:
+        """Tell that "tiles" were changed in place, so kept payload is dropped at once"""
+        self.__dict__.pop('_payload', None)
+        super().mark_modified()
+
+    def _valid_payload(self) -> Optional[EncodedTiles]:
+        encoded = self.__dict__.get('encoded_tiles')
+        if encoded is not None:
+            return encoded
+        encoded = self.__dict__.get('_payload')
+        if encoded is not None and encoded.digest != tiles_digest(self.tiles):
+            # "tiles" were changed in place
+            del self.__dict__['_payload']
+            return None
+        return encoded
+
+    def payload(self, encoding: Optional[str], compression: Optional[str],
+                compressionlevel: Optional[int] = None) -> Optional[str]:
+        """Encoded text of unmodified "tiles" if it is in given encoding, compression and compressionlevel"""
+        encoded = self._valid_payload()
+        if encoded is not None and encoded.is_encoded_as(encoding, compression, compressionlevel):
+            return encoded.text
+        return None
+
+    def _keep_payload(self, text: str, encoding: str, compression: Optional[str], compact: bool,
+                      compressionlevel: Optional[int] = None) -> None:
+        if len(text) <= PAYLOAD_MAX_SIZE:
+            self.__dict__['_payload'] = EncodedTiles(text, encoding, compression, compact, compressionlevel,
+                                                     tiles_digest(self.tiles))
+
+    def _iter_kept_payload(self, pieces: Iterable[str], encoding: str, compression: Optional[str],
+                           compressionlevel: Optional[int] = None) -> Iterator[str]:
+        """Yields pieces of encoded "tiles" and keeps them as payload when they are all written"""
+        kept = []
+        size = 0
+        for piece in pieces:
+            if size <= PAYLOAD_MAX_SIZE:
+                kept.append(piece)
+                size += len(piece)
+            yield piece
+        if size <= PAYLOAD_MAX_SIZE:
+            self._keep_payload(''.join(kept), encoding, compression, isinstance(self.tiles, array), compressionlevel)
+
+
+class IndexedTiles:
+    """GidIndex of "tiles" built on first call of "gid_positions", "gid_count" or "replace_gid", it is dropped
+    when "tiles" is assigned or "mark_modified" is called after change of "tiles" in place.
+
+    "set_tile" and "replace_gid" keep index up to date instead of dropping it. "used_gids" does not need index.
+    """
+    INDEXED_FIELDS = ('tiles', 'childs')
+
+    @property
+    def gid_index(self) -> GidIndex:
+        index = self.__dict__.get('_gid_index')
+        if index is None:
+            index = GidIndex(self.tiles)
+            self.__dict__['_gid_index'] = index
+        return index
+
+    def invalidate_gid_index(self) -> None:
+        self.__dict__.pop('_gid_index', None)
+
+    def mark_modified(self) -> None:
+        self.invalidate_gid_index()
+
+    def used_gids(self) -> set:
+        """Gids of not empty tiles"""
+        index = self.__dict__.get('_gid_index')
+        if index is not None:
+            return index.used_gids()
+        gids = set(self.tiles)
+        gids.discard(0)
+        return gids
+
+    def gid_positions(self, gid: int) -> List[int]:
+        if not gid:
+            return gids_positions(self.tiles, {gid})[gid]
+        return self.gid_index.positions(gid)
+
+    def gid_count(self, gid: int) -> int:
+        if not gid:
+            return self.tiles.count(gid)
+        return self.gid_index.count(gid)
+
+    def set_tile(self, position: int, gid: int) -> None:
+        tiles = self.tiles
+        old_gid = tiles[position]
+        if old_gid == gid:
+            return
+        tiles[position] = gid
+        index = self.__dict__.get('_gid_index')
+        self.mark_modified()
+        if index is not None:
+            # index is kept up to date instead of being built again
+            index.set(position, old_gid, gid)
+            self.__dict__['_gid_index'] = index
+
+    def replace_gid(self, old_gid: int, new_gid: int) -> int:
+        """Replace every old_gid with new_gid, returns count of replaced tiles"""
+        if old_gid == new_gid:
+            return self.gid_count(old_gid)
+        tiles = self.tiles
+        index = self.gid_index
+        positions = index.pop(old_gid) if old_gid else self.gid_positions(old_gid)
+        if positions:
+            for position in positions:
+                tiles[position] = new_gid
+            index.add(new_gid, positions)
+            self.mark_modified()
+            self.__dict__['_gid_index'] = index
+        return len(positions)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in self.INDEXED_FIELDS:
+            self.__dict__.pop('_gid_index', None)
+        super().__setattr__(name, value)
+
+
+@dataclass
+class Chunk(LazyTiles, IndexedTiles):
     x: int
     y: int
     width: int
     height: int
     tiles: List[int]
 
-    def validate(self) -> None:
+    def validate(self, structural: bool = False) -> None:
+        """Structural validation skips checks of every tile and keeps lazy "tiles" encoded"""
         if not all(isinstance(field, int) for field in (self.x, self.y)):
             raise MapIntValidationError(('x', 'y'),)
         if not all(isinstance(field, int) and field > 0 for field in (self.width, self.height)):
             raise MapIntValidationError(('width', 'height'), 0)
-        if not (isinstance(self.tiles, list) and all(isinstance(tile, int) for tile in self.tiles)
-                and len(self.tiles) == self.width * self.height):
+        if structural and not self.decoded:
+            return
+        if not (valid_tiles(self.tiles, structural) and len(self.tiles) == self.width * self.height):
             raise MapValidationError('Field "tiles" must be list of int type and len must be equal "width" * "height"')
 
     def get_element(self, file_dir: str, new_file_dir: str) -> ET.Element:
@@ -144,88 +343,146 @@ class Chunk:
 
 
 @dataclass
-class Data:
+class Data(LazyTiles, IndexedTiles):
     encoding: Optional[str]
     compression: Optional[str]
     tiles: List[int]
     chunks: List[Chunk]
     childs: Union[List[int], List[Chunk]]
+    compressionlevel: Optional[int] = None
 
-    def validate(self) -> None:
+    LAZY_FIELDS = ('tiles', 'childs')
+
+    def validate(self, structural: bool = False) -> None:
+        """Structural validation skips checks of every tile and keeps lazy "tiles" encoded"""
         if not (self.encoding is None or isinstance(self.encoding, str) and self.encoding in ('csv', 'base64')):
             raise MapValidationError('Field "encoding" must be in ("csv", "base64")')
         if not (self.encoding != 'base64'
                 or (self.compression is None
-                    or isinstance(self.compression, str) and self.compression in('gzip', 'zlib'))):
-            raise MapValidationError('Field "compression" must be in ("gzip", "zlib")')
-        if not (isinstance(self.tiles, list) and all(isinstance(tile, int) for tile in self.tiles)):
-            raise MapValidationError('Field "tiles" must be list of int type')
+                    or isinstance(self.compression, str) and self.compression in ('gzip', 'zlib', 'zstd'))):
+            raise MapValidationError('Field "compression" must be in ("gzip", "zlib", "zstd")')
+        if self.compressionlevel is not None:
+            max_level = MAX_COMPRESSION_LEVELS.get(self.compression, 9)
+            if not (isinstance(self.compressionlevel, int) and -2 < self.compressionlevel <= max_level):
+                raise MapIntValidationError('compressionlevel', -2, max_level + 1)
         if not (isinstance(self.chunks, list) and all(isinstance(chunk, Chunk) for chunk in self.chunks)):
             raise MapValidationError('Field "tiles" must be list of Chunk type')
-        if not (isinstance(self.childs, list)
-                and (all(isinstance(child, int) for child in self.childs) or
-                     all(isinstance(child, Chunk) for child in self.childs))):
-            raise MapValidationError('Field "childs" must be list of int or list of Chunk type with 0 < len < 2')
-        if not (self.tiles == self.childs and not self.chunks or self.chunks == self.childs and not self.tiles):
+        if not (structural and not self.decoded):
+            self._validate_childs(structural)
+        for chunk in self.chunks:
+            chunk.validate(structural)
+
+    def _validate_childs(self, structural: bool) -> None:
+        if not valid_tiles(self.tiles, structural):
+            raise MapValidationError('Field "tiles" must be list of int type')
+        if self.childs is self.tiles:
+            valid_childs = not self.chunks
+        elif isinstance(self.childs, list) and same_items(self.childs, self.chunks):
+            valid_childs = not self.tiles
+        elif isinstance(self.childs, list) and not structural:
+            valid_childs = valid_tiles(self.childs) and self.childs == self.tiles and not self.chunks
+        else:
+            valid_childs = False
+        if not valid_childs:
             raise MapValidationError('Field "childs" must be equal only one "tiles" or "chunks", '
                                      'and other "tiles" or "chunks" must be None')
-        for chunk in self.chunks:
-            chunk.validate()
 
     @classmethod
-    def from_element(cls, data: ET.Element) -> Data:
+    def from_element(cls, data: ET.Element, compact: bool = False, lazy: bool = False,
+                     compressionlevel: Optional[int] = None) -> Data:
+        """Lazy tiles are kept encoded, "compressionlevel" of map is level their text is written with"""
         encoding = data.attrib.get('encoding', None)
         compression = data.attrib.get('compression')
-        tiles = []
+        tiles = make_tiles((), compact)
         chunks = []
         infinite = bool(data.find('chunk') is not None)
+        lazy = lazy and encoding is not None
         if infinite:
             for child in data:
                 x = int_or_none(child.attrib.get('x'))
                 y = int_or_none(child.attrib.get('y'))
                 width = int_or_none(child.attrib.get('width'))
                 height = int_or_none(child.attrib.get('height'))
-                child_tiles = cls._fill_tiles(child, encoding, compression)
-                child_object = Chunk(x, y, width, height, child_tiles)
+                if lazy:
+                    encoded = EncodedTiles(child.text.strip(), encoding, compression, compact, compressionlevel)
+                    child_object = Chunk.from_encoded(encoded, x=x, y=y, width=width, height=height)
+                else:
+                    child_tiles = cls._fill_tiles(child, encoding, compression, compact)
+                    child_object = Chunk(x, y, width, height, child_tiles)
                 chunks.append(child_object)
             childs = chunks
+        elif lazy:
+            encoded = EncodedTiles(data.text.strip(), encoding, compression, compact, compressionlevel)
+            return cls.from_encoded(encoded, encoding=encoding, compression=compression, chunks=chunks)
         else:
-            tiles = cls._fill_tiles(data, encoding, compression)
+            tiles = cls._fill_tiles(data, encoding, compression, compact)
             childs = tiles
         return cls(encoding, compression, tiles, chunks, childs)
 
     @classmethod
-    def _fill_tiles(cls, data: ET.Element, encoding: str, compression: str) -> List[int]:
-        tiles = []
+    def _fill_tiles(cls, data: ET.Element, encoding: str, compression: str, compact: bool = False) -> List[int]:
         if encoding is None:
-            for child in data:
-                tiles.append(int_or_none(child.attrib.get('gid', 0)))
-        elif encoding == 'csv':
-            tiles = list(map(int, data.text.strip().split(',')))
+            return make_tiles((int_or_none(child.attrib.get('gid', 0)) for child in data), compact)
+        return cls.decode_text(data.text, encoding, compression, compact)
+
+    @staticmethod
+    def decode_text(text: str, encoding: str, compression: str, compact: bool = False) -> List[int]:
+        if encoding == 'csv':
+            tiles = make_tiles(map(int, text.strip().split(',')), compact)
         elif encoding == 'base64':
-            data = base64.b64decode(data.text.strip().encode("latin1"))
+            # whitespace around text is discarded by b64decode without copies of text
+            data = base64.b64decode(text)
             if compression == 'gzip':
                 data = gzip.decompress(data)
             elif compression == 'zlib':
                 data = zlib.decompress(data)
+            elif compression == 'zstd':
+                data = zstd_decompress(data)
             elif compression is not None:
                 raise ValueError("Compression format {} not supported.".format(compression))
-            data = zip(data[::4], data[1::4], data[2::4], data[3::4])
-            tiles = list(map(four_bytes, data))
+            tiles = tiles_from_bytes(data, compact)
         else:
             raise ValueError("Encoding format {} not supported.". format(encoding))
         return tiles
 
+    @property
+    def modified(self) -> bool:
+        if self.chunks:
+            return any(chunk.modified for chunk in self.chunks)
+        return super().modified
+
+    def _chunk_text_data(self, chunk: Chunk) -> str:
+        payload = chunk.payload(self.encoding, self.compression, self._compressionlevel())
+        if payload is not None:
+            return payload
+        return self._fill_text_data(chunk.tiles)
+
+    def _iter_chunk_text_data(self, chunk: Chunk, compressionlevel: Optional[int] = None) -> Iterator[str]:
+        level = self._compressionlevel(compressionlevel)
+        payload = chunk.payload(self.encoding, self.compression, level)
+        if payload is not None:
+            return iter((payload,))
+        return chunk._iter_kept_payload(self._iter_text_data(chunk.tiles, compressionlevel), self.encoding,
+                                        self.compression, level)
+
     def _fill_text_data(self, tiles) -> str:
+        if self.encoding in ('csv', 'base64'):
+            return ''.join(self._iter_text_data(tiles))
+
+    def _compressionlevel(self, map_compressionlevel: Optional[int] = None) -> Optional[int]:
+        """Own compressionlevel of data overrides compressionlevel of map"""
+        return map_compressionlevel if self.compressionlevel is None else self.compressionlevel
+
+    def _iter_text_data(self, tiles, map_compressionlevel: Optional[int] = None) -> Iterator[str]:
+        """Encoded text of tiles in pieces, whole raw or compressed payload is never built"""
         if self.encoding == 'csv':
-            return ','.join(map(str, tiles))
+            separator = ''
+            for start in range(0, len(tiles), TILES_PIECE_SIZE):
+                yield separator + ','.join(map(str, tiles[start:start + TILES_PIECE_SIZE]))
+                separator = ','
         elif self.encoding == 'base64':
-            data = bytes(chain.from_iterable(map(get_four_bytes, tiles)))
-            if self.compression == 'zlib':
-                data = zlib.compress(data)
-            elif self.compression == 'gzip':
-                data = gzip.compress(data)
-            return base64.b64encode(data).decode("latin1")
+            yield from iter_base64(iter_compressed(iter_tiles_bytes(tiles), self.compression,
+                                                   self._compressionlevel(map_compressionlevel)))
 
     def get_element(self, file_dir: str, new_file_dir: str) -> ET.Element:
         encoding: Optional[str]
@@ -238,7 +495,10 @@ class Data:
             'compression': self.compression,
         }
         root = ET.Element('data', attrib=clear_dict_from_none(attrib))
-        if self.tiles:
+        payload = self.payload(self.encoding, self.compression, self._compressionlevel())
+        if payload is not None:
+            root.text = payload
+        elif self.tiles:
             if not self.encoding:
                 for tile in self.tiles:
                     if tile:
@@ -250,12 +510,39 @@ class Data:
                 root.text = self._fill_text_data(self.tiles)
         else:
             for child in self.childs:
-                child_root = ET.Element('chunk', attrib={'x': str(child.x), 'y': str(child.y),
-                                                         'width': str(child.width), 'height': str(child.height)})
-                child_root.text = self._fill_text_data(child.tiles)
+                child_root = ET.Element('chunk', attrib=self._chunk_attrib(child))
+                child_root.text = self._chunk_text_data(child)
                 root.append(child_root)
         return root
 
+    @staticmethod
+    def _chunk_attrib(chunk: Chunk) -> dict:
+        return {'x': str(chunk.x), 'y': str(chunk.y), 'width': str(chunk.width), 'height': str(chunk.height)}
+
+    def write_xml(self, writer: TmxWriter, level: int, tail: Optional[str]) -> None:
+        """Same as get_element written by TmxWriter, payload is encoded and written piece by piece"""
+        attrib = clear_dict_from_none({'encoding': self.encoding, 'compression': self.compression})
+        compressionlevel = self._compressionlevel(writer.compressionlevel)
+        payload = self.payload(self.encoding, self.compression, compressionlevel)
+        if payload is not None:
+            writer.write_text_element('data', attrib, (payload,), tail)
+        elif self.tiles:
+            if not self.encoding:
+                writer.write_tiles_element('data', attrib, self.tiles, level, tail)
+            else:
+                pieces = self._iter_text_data(self.tiles, writer.compressionlevel)
+                writer.write_text_element('data', attrib,
+                                          self._iter_kept_payload(pieces, self.encoding, self.compression,
+                                                                  compressionlevel),
+                                          tail)
+        else:
+            writer.write_parent(ET.Element('data', attrib=attrib), self.childs, level, tail,
+                                partial(self._write_chunk_xml, writer))
+
+    def _write_chunk_xml(self, writer: TmxWriter, chunk: Chunk, level: int, tail: Optional[str]) -> None:
+        writer.write_text_element('chunk', self._chunk_attrib(chunk),
+                                  self._iter_chunk_text_data(chunk, writer.compressionlevel), tail)
+
 
 @dataclass
 class Image:
@@ -280,7 +567,7 @@ class Image:
             raise MapValidationError('Field "data" must be Data type or None')
         if not (isinstance(self.childs, list) and len(self.childs) < 2
                 and all(isinstance(child, Data)
-                        and self.data == child for child in self.childs)):
+                        and self.data is child for child in self.childs)):
             raise MapValidationError('Field "childs" must be list of Data type with len < 2')
 
         for child in self.childs:
@@ -1015,11 +1302,21 @@ class TileSet:
         firstgid = int(tileset.attrib.get('firstgid'))
         source = tileset.attrib.get('source', None)
         if source:
-            source_with_path = pathlib.PurePath(file_dir, source).as_posix()
-            tileset_tree = ET.parse(source_with_path)
-            tileset_root = tileset_tree.getroot()
-        else:
-            tileset_root = tileset
+            return cls.from_source(firstgid, source, file_dir)
+        return cls.from_root(firstgid, source, tileset)
+
+    @classmethod
+    def from_source(cls, firstgid: int, source: str, file_dir) -> TileSet:
+        """External tileset file is parsed once per file version, every map gets its own TileSet built from kept
+        XML tree, so tilesets of maps share no mutable objects"""
+        source_with_path = os.path.realpath(pathlib.PurePath(file_dir, source).as_posix())
+        stat = os.stat(source_with_path)
+        key = (source_with_path, stat.st_mtime_ns, stat.st_size)
+        tileset_root = TILESET_CACHE.get(key, lambda: ET.parse(source_with_path).getroot())
+        return cls.from_root(firstgid, source, tileset_root)
+
+    @classmethod
+    def from_root(cls, firstgid: int, source: Optional[str], tileset_root: ET.Element) -> TileSet:
         name = tileset_root.attrib.get('name')
         tilewidth = int(tileset_root.attrib.get('tilewidth'))
         tileheight = int(tileset_root.attrib.get('tileheight'))
@@ -1117,8 +1414,9 @@ class Layer:
     properties: Optional[Properties]
     data: Data  # validate Data len(tiles) if not infinite map?
     childs: List[Union[Properties, Data]]
+    tintcolor: Optional[Color] = None
 
-    def validate(self) -> None:
+    def validate(self, structural: bool = False) -> None:
         if not (isinstance(self.id, int) and self.id > 0):
             raise MapIntValidationError("id", 0)
         if not isinstance(self.name, str):
@@ -1133,6 +1431,8 @@ class Layer:
             raise MapValidationError('Fields "offsetx" and "offsety" must be None or float together')
         if not isinstance(self.visible, bool):
             return MapValidationError('Field "visible" must be bool type')
+        if not (self.tintcolor is None or isinstance(self.tintcolor, Color)):
+            raise MapValidationError('Field "tintcolor" must be None or Color type')
         if not (isinstance(self.childs, list)
                 and (all(isinstance(child, Properties) or
                          isinstance(child, Data) for child in self.childs))):
@@ -1146,10 +1446,14 @@ class Layer:
         if len([child for child in self.childs if isinstance(child, Data)]) > 1:
             raise MapValidationError('Properties type must be < 2 times in "childs"')
         for child in self.childs:
-            child.validate()
+            if isinstance(child, Data):
+                child.validate(structural)
+            else:
+                child.validate()
 
     @classmethod
-    def from_element(cls, layer: ET.Element) -> Layer:
+    def from_element(cls, layer: ET.Element, compact: bool = False, lazy: bool = False,
+                     compressionlevel: Optional[int] = None) -> Layer:
         layer_id = int_or_none(layer.attrib.get('id', None))
         name = layer.attrib.get('name', None)
         x = int_or_none(layer.attrib.get('x', None))
@@ -1158,6 +1462,7 @@ class Layer:
         height = int_or_none(layer.attrib.get('height', None))
         opacity = float_or_none(layer.attrib.get('opacity', None))
         visible = bool(int(layer.attrib.get('visible', 1)))
+        tintcolor = Color(layer.attrib.get('tintcolor')) if layer.attrib.get('tintcolor', None) else None
         offsetx = float_or_none(layer.attrib.get('offsetx', None))
         offsety = float_or_none(layer.attrib.get('offsety', None))
 
@@ -1170,12 +1475,13 @@ class Layer:
                 properties = Properties.from_element(child)
                 childs.append(properties)
             elif child.tag == 'data':
-                data = Data.from_element(child)
+                data = Data.from_element(child, compact, lazy, compressionlevel)
                 childs.append(data)
         return cls(layer_id, name, x, y, width, height, opacity, visible,
-                     offsetx, offsety, properties, data, childs)
+                     offsetx, offsety, properties, data, childs, tintcolor)
 
-    def get_element(self, file_dir: str, new_file_dir: str) -> ET.Element:
+    def get_root_element(self) -> ET.Element:
+        """Element without childs"""
         attrib = {
             'id': str(self.id),
             'name': self.name,
@@ -1185,14 +1491,21 @@ class Layer:
             'height': str(self.height),
             'opacity': str(self.opacity) if self.opacity else None,
             'visible': '0' if not self.visible else None,
+            'tintcolor': self.tintcolor.hex_color if self.tintcolor else None,
             'offsetx': str(self.offsetx) if self.offsetx else None,
             'offsety': str(self.offsety) if self.offsety else None
         }
-        root = ET.Element('layer', attrib=clear_dict_from_none(attrib))
+        return ET.Element('layer', attrib=clear_dict_from_none(attrib))
+
+    def get_element(self, file_dir: str, new_file_dir: str) -> ET.Element:
+        root = self.get_root_element()
         for child in self.childs:
             root.append(child.get_element(file_dir, new_file_dir))
         return root
 
+    def write_xml(self, writer: TmxWriter, level: int, tail: Optional[str]) -> None:
+        writer.write_parent(self.get_root_element(), self.childs, level, tail)
+
 
 @dataclass
 class ImageLayer:
@@ -1291,8 +1604,9 @@ class Group:
     imagelayers: List[ImageLayer]
     groups: List[Group]
     childs: List[Properties, Layer, ObjectGroup, ImageLayer, Group]
+    tintcolor: Optional[Color] = None
 
-    def validate(self) -> None:
+    def validate(self, structural: bool = False) -> None:
         if not (isinstance(self.id, int) and self.id > 0):
             raise MapIntValidationError("id", 0)
         if not isinstance(self.name, str):
@@ -1303,6 +1617,8 @@ class Group:
             raise MapValidationError('Fields "offsetx" and "offsety" must be None or float together')
         if not isinstance(self.visible, bool):
             return MapValidationError('Field "visible" must be bool type')
+        if not (self.tintcolor is None or isinstance(self.tintcolor, Color)):
+            raise MapValidationError('Field "tintcolor" must be None or Color type')
         if not all(isinstance(layer, Layer) for layer in self.layers):
             raise MapValidationError('Field "layers" must be list of Layer')
         if not all(isinstance(objectgroup, ObjectGroup) for objectgroup in self.objectgroups):
@@ -1324,15 +1640,21 @@ class Group:
         if len([child for child in self.childs if isinstance(child, Properties)]) > 1:
             raise MapValidationError('Properties type must be < 2 times in "childs"')
         for child in self.childs:
-            child.validate()
+            if isinstance(child, (Layer, Group)):
+                child.validate(structural)
+            else:
+                child.validate()
+
     @classmethod
-    def from_element(cls, group: ET.Element) -> Group:
+    def from_element(cls, group: ET.Element, compact: bool = False, lazy: bool = False,
+                     compressionlevel: Optional[int] = None) -> Group:
         group_id = int_or_none(group.attrib.get('id', None))
         name = group.attrib.get('name', None)
         offsetx = float_or_none(group.attrib.get('offsetx', None))
         offsety = float_or_none(group.attrib.get('offsety', None))
         opacity = float_or_none(group.attrib.get('opacity', None))
         visible = bool(int(group.attrib.get('visible', 1)))
+        tintcolor = Color(group.attrib.get('tintcolor')) if group.attrib.get('tintcolor', None) else None
 
         properties = None
         group_layers = []
@@ -1347,7 +1669,7 @@ class Group:
                 child_object = Properties.from_element(child)
                 properties = child_object
             elif child.tag == 'layer':
-                child_object = Layer.from_element(child)
+                child_object = Layer.from_element(child, compact, lazy, compressionlevel)
                 layers.append(child_object)
                 group_layers.append(child_object)
             elif child.tag == 'objectgroup':
@@ -1359,29 +1681,37 @@ class Group:
                 imagelayers.append(child_object)
                 group_layers.append(child_object)
             elif child.tag == 'group':
-                child_object = cls.from_element(child)
+                child_object = cls.from_element(child, compact, lazy, compressionlevel)
                 groups.append(child_object)
                 group_layers.append(child_object)
             else:
                 continue
             childs.append(child_object)
         return cls(group_id, name, offsetx, offsety, opacity, visible, properties,
-                     layers, objectgroups, imagelayers, groups, childs)
+                     layers, objectgroups, imagelayers, groups, childs, tintcolor)
 
-    def get_element(self, file_dir: str, new_file_dir: str) -> ET.Element:
+    def get_root_element(self) -> ET.Element:
+        """Element without childs"""
         attrib = {
             'id': str(self.id),
             'name': self.name,
             'opacity': str(self.opacity) if self.opacity else None,
             'visible': '0' if not self.visible else None,
+            'tintcolor': self.tintcolor.hex_color if self.tintcolor else None,
             'offsetx': str(self.offsetx) if self.offsetx else None,
             'offsety': str(self.offsety) if self.offsety else None
         }
-        root = ET.Element('group', attrib=clear_dict_from_none(attrib))
+        return ET.Element('group', attrib=clear_dict_from_none(attrib))
+
+    def get_element(self, file_dir: str, new_file_dir: str) -> ET.Element:
+        root = self.get_root_element()
         for child in self.childs:
             root.append(child.get_element(file_dir, new_file_dir))
         return root
 
+    def write_xml(self, writer: TmxWriter, level: int, tail: Optional[str]) -> None:
+        writer.write_parent(self.get_root_element(), self.childs, level, tail)
+
 
 class MapError(Exception):
     def __init__(self, message: str) -> None:
@@ -0,0 +1,129 @@
+from __future__ import annotations
+from typing import Any, Callable, Iterable, List, Optional
+import xml.etree.ElementTree as ET
+
+XML_DECLARATION = "<?xml version='1.0' encoding='UTF-8'?>\n"
+# Tile elements of XML encoded data joined before one write
+TILE_ELEMENTS_PIECE_SIZE = 2**12
+
+
+def escape_cdata(text: str) -> str:
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    return text
+
+
+def escape_attrib(text: str) -> str:
+    text = escape_cdata(text)
+    if '"' in text:
+        text = text.replace('"', '&quot;')
+    if '\r' in text:
+        text = text.replace('\r', '&#13;')
+    if '\n' in text:
+        text = text.replace('\n', '&#10;')
+    if '\t' in text:
+        text = text.replace('\t', '&#09;')
+    return text
+
+
+def indentation(level: int) -> str:
+    return '\n' + level * '  '
+
+
+def is_blank(text: Optional[str]) -> bool:
+    return not text or not text.strip()
+
+
+class TmxWriter:
+    """Writes TMX document straight to text stream in one pass.
+
+    Output is the same as ElementTree.write of tree built by get_element methods and formatted by
+    helpers.indent. Objects with "write_xml" method (data, layers, groups) write themselves piece by piece,
+    other objects are written from their get_element. "compressionlevel" of map is used by data without its own.
+    """
+    def __init__(self, write: Callable[[str], Any], file_dir: str, new_file_dir: str,
+                 compressionlevel: Optional[int] = None) -> None:
+        self.write = write
+        self.file_dir = file_dir
+        self.new_file_dir = new_file_dir
+        self.compressionlevel = compressionlevel
+
+    def write_declaration(self) -> None:
+        self.write(XML_DECLARATION)
+
+    def write_object(self, tmx_object: Any, level: int, tail: Optional[str]) -> None:
+        write_xml = getattr(tmx_object, 'write_xml', None)
+        if write_xml is not None:
+            write_xml(self, level, tail)
+        else:
+            self.write_element(tmx_object.get_element(self.file_dir, self.new_file_dir), level, tail)
+
+    def _start_tag(self, tag: str, attrib: dict) -> None:
+        self.write('<' + tag + ''.join(' {}="{}"'.format(key, escape_attrib(value))
+                                       for key, value in attrib.items()))
+
+    def _end(self, tag: Optional[str], tail: Optional[str]) -> None:
+        """Closes open element, tag None closes empty element"""
+        self.write(' />' if tag is None else '</' + tag + '>')
+        if tail:
+            self.write(escape_cdata(tail))
+
+    def write_element(self, element: ET.Element, level: int, tail: Optional[str]) -> None:
+        self.write_parent(element, list(element), level, tail, self._write_child_element)
+
+    def _write_child_element(self, element: ET.Element, level: int, tail: Optional[str]) -> None:
+        if not is_blank(element.tail):
+            tail = element.tail
+        self.write_element(element, level, tail)
+
+    def write_parent(self, element: ET.Element, childs: List[Any], level: int, tail: Optional[str],
+                     write_child: Optional[Callable[[Any, int, Optional[str]], None]] = None) -> None:
+        """Writes element with childs written by write_child, by default with write_object"""
+        if write_child is None:
+            write_child = self.write_object
+        self._start_tag(element.tag, element.attrib)
+        text = element.text
+        if childs and is_blank(text):
+            text = indentation(level + 1)
+        if not (text or childs):
+            self._end(None, tail)
+            return
+        self.write('>')
+        if text:
+            self.write(escape_cdata(text))
+        last = len(childs) - 1
+        for i, child in enumerate(childs):
+            write_child(child, level + 1, indentation(level + 1) if i < last else indentation(level))
+        self._end(element.tag, tail)
+
+    def write_text_element(self, tag: str, attrib: dict, pieces: Iterable[str], tail: Optional[str]) -> None:
+        """Writes element without childs, text comes in pieces"""
+        self._start_tag(tag, attrib)
+        pieces = iter(pieces)
+        first = next((piece for piece in pieces if piece), None)
+        if first is None:
+            self._end(None, tail)
+            return
+        self.write('>')
+        self.write(escape_cdata(first))
+        for piece in pieces:
+            self.write(escape_cdata(piece))
+        self._end(tag, tail)
+
+    def write_tiles_element(self, tag: str, attrib: dict, tiles: Iterable[int], level: int,
+                            tail: Optional[str]) -> None:
+        """Writes element with <tile gid="..."/> child for every gid, tiles must be not empty"""
+        self._start_tag(tag, attrib)
+        self.write('>')
+        separator = indentation(level + 1)
+        gid_tile = separator + '<tile gid="{}" />'
+        empty_tile = separator + '<tile />'
+        for start in range(0, len(tiles), TILE_ELEMENTS_PIECE_SIZE):
+            self.write(''.join(gid_tile.format(tile) if tile else empty_tile
+                               for tile in tiles[start:start + TILE_ELEMENTS_PIECE_SIZE]))
+        self.write(indentation(level))
+        self._end(tag, tail)
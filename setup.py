@@ -10,7 +10,10 @@ setup(
     download_url='https://github.com/yobagram/cyclic-gen-tmx/archive/v_013.tar.gz',
     version="0.1.3",
     include_package_data=True,
-    install_requires=["Pillow>=7.0.0"],
+    # renderer pastes with Pillow core images (Image.im, Image.core.alpha_composite, writable frombuffer images),
+    # they are tested from Pillow 9.3.0
+    install_requires=["Pillow>=9.3.0"],
+    entry_points={'console_scripts': ['cyclicgentmx-batch=cyclicgentmx.map_batch:main']},
     keywords=['tmx', 'map', 'generation', 'save', 'image'],
     classifiers=[
         'Development Status :: 3 - Alpha',